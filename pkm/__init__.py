@@ -12,6 +12,9 @@ VERSION = '0.7'
 CONFIGDIR = os.path.join(os.getenv('HOME'), '.config', 'pkmeter')
 CONFIGPATH = os.path.join(CONFIGDIR, 'config.json')
 STATUSFILE = os.path.join(CONFIGDIR, 'status.json')
+CACHEDIR = os.path.join(CONFIGDIR, 'cache')
+CHARTDIR = os.path.join(CONFIGDIR, 'charts')
+HISTORYDIR = os.path.join(CONFIGDIR, 'history')
 WORKDIR = os.path.dirname(os.path.dirname(__file__))
 PLUGINDIR = os.path.join(WORKDIR, 'pkm', 'plugins')
 SHAREDIR = os.path.join(WORKDIR, 'share')
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Collector
+Loads the plugins and keeps their data. This is the base of the desktop app
+and runs on its own with pkmeter --headless, writing each plugin update as a
+JSON line. Nothing here imports Qt.
+"""
+import json, keyring, os, pkgutil, signal
+import sys, threading, time
+from datetime import datetime
+from pkm import APPNAME, CONFIGPATH, HISTORYDIR, PLUGINDIR
+from pkm import log, streamhandler, utils, windows
+from pkm.exporter import MetricsExporter
+from pkm.timeseries import TimeSeriesStore
+
+
+class Collector(object):
+    """ Plugin loading and data handling shared by all modes. """
+
+    def _init_exporter(self):
+        if not self.opts.metrics_port:
+            return None
+        try:
+            return MetricsExporter(self.opts.metrics_port)
+        except OSError as err:
+            log.error('Unable to start metrics exporter on port %s: %s', self.opts.metrics_port, err)
+
+    def _load_modules(self):
+        modules = {}
+        for loader, name, ispkg in pkgutil.iter_modules([PLUGINDIR]):
+            try:
+                module = loader.find_module(name).load_module(name)
+                namespace = utils.namespace(module)
+                modules[namespace] = module
+            except Exception as err:
+                log.warn('Error loading module %s: %s', name, err)
+                if self.opts.verbose:
+                    log.exception(err)
+        return modules
+
+    def _init_plugins(self):
+        plugins = {}
+        for namespace, module in self.modules.items():
+            plugincls = getattr(module, 'Plugin', None)
+            if plugincls:
+                try:
+                    plugin = module.Plugin(self)
+                    plugins[plugin.namespace] = plugin
+                except:
+                    log.exception('Error initalizing plugin: %s', namespace)
+        return plugins
+
+    def _start_plugins(self):
+        for plugin in self.plugins.values():
+            plugin.start()
+        log.info('Started in %.0fms', (time.perf_counter() - self.opts.started) * 1000)
+
+    def iter_limit(self, varpath):
+        """ Max rows shown for iter=varpath, or None if not limited. """
+        return None
+
+    def update(self, plugin):
+        with self.rlock:
+            namespace = utils.namespace(plugin.__module__)
+            self.data[namespace] = plugin.data
+            self.data[namespace]['lastupdate'] = datetime.now()
+            self.history.add(namespace, plugin.data)
+            windows.update_windows(namespace, self.data)
+            if self.exporter:
+                self.exporter.update(namespace, plugin.data)
+            return namespace
+
+
+class Signal(object):
+    """ Stand-in for pyqtSignal; slots are called in the emitting thread. """
+
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self.slots:
+            slot(*args)
+
+
+class HeadlessConfig(object):
+    """ Read only config values when there is no preferences window. """
+
+    def __init__(self):
+        self.values = self.load()
+
+    def get(self, namespace, path, default=None, from_keyring=False):
+        path = '%s.%s' % (namespace, path)
+        if from_keyring:
+            value = keyring.get_password(APPNAME, path)
+        else:
+            value = utils.rget(self.values, path)
+        return value if value is not None else default
+
+    def load(self):
+        log.info('Loading config: %s' % CONFIGPATH)
+        if os.path.isfile(CONFIGPATH):
+            with open(CONFIGPATH, 'r') as handle:
+                return json.load(handle)
+        return {}
+
+
+class HeadlessCollector(Collector):
+    """ Runs every plugin and writes each update as a JSON line. """
+
+    def __init__(self, opts):
+        log.setLevel(opts.loglevel)                     # Set the log level
+        self.opts = opts                                # Command line options
+        self.output = self._init_output()               # File to write updates to
+        self.rlock = threading.RLock()                  # Lock for updates
+        self.data = {}                                  # Cached data from all namespaces
+        self.history = TimeSeriesStore(HISTORYDIR)      # History of all numeric values
+        self.exporter = self._init_exporter()           # Optional metrics endpoint
+        self.plugin_updated = Signal()                  # Plugin updated signal
+        self.plugin_updated.connect(self.update)        # Plugin updated signal handler
+        self.modules = self._load_modules()             # Import all plugins
+        self.config = HeadlessConfig()                  # Config Values
+        self.plugins = self._init_plugins()             # Init plugins (but dont start yet)
+        self.actions = {ns:[] for ns in self.plugins}   # No layout; every plugin is used
+        self._start_plugins()                           # Start all plugins
+        signal.signal(signal.SIGINT, self.quit)         # Quit on Ctrl+C
+        signal.signal(signal.SIGTERM, self.quit)        # Quit when stopped
+
+    def _init_output(self):
+        if self.opts.output in (None, '-'):
+            streamhandler.setStream(sys.stderr)  # Keep stdout for data
+        log.info('--- Starting PKMeter (headless) ---')
+        if self.opts.output in (None, '-'):
+            return sys.stdout
+        return open(self.opts.output, 'a', buffering=1)
+
+    def update(self, plugin):
+        with self.rlock:
+            namespace = super(HeadlessCollector, self).update(plugin)
+            if plugin.data.get('enabled'):
+                snapshot = {'namespace':namespace, 'timestamp':time.time(), 'data':plugin.data}
+                self.output.write(json.dumps(snapshot, default=str, sort_keys=True) + '\n')
+                self.output.flush()
+
+    def run(self):
+        while True:
+            time.sleep(1)
+
+    def quit(self, *args):
+        log.info('Quitting..')
+        with self.rlock:
+            self.history.close()
+            if self.exporter:
+                self.exporter.close()
+            if self.output is not sys.stdout:
+                self.output.close()
+        sys.exit(0)
+
+
+def start_headless(opts):
+    HeadlessCollector(opts).run()
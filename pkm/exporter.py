@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Metrics Exporter
+Serves every numeric value in PKMeter.data in the Prometheus text format.
+Each namespace is rendered when its plugin updates and the response body is
+rebuilt from those cached chunks, so a scrape only writes out bytes.
+"""
+import math, re, threading
+from collections import Counter, OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pkm import log
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LABELKEYS = ('iface', 'mountpoint', 'pid', 'device', 'id', 'name', 'username', 'title')  # Preferred labels for list items
+PREFIX = 'pkmeter'
+
+
+def metric_name(*parts):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join(str(p) for p in parts))
+
+
+def label_value(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render(namespace, data):
+    """ Render all numeric leaves of data as gauges. Lists of dicts become one
+        series per item, labeled with the first key from LABELKEYS the items
+        have (ie: iface for network.nics) or by index otherwise. Items whose
+        label is not unique in the list (ie: two events with the same title)
+        get their index as well.
+    """
+    metrics = OrderedDict()
+    _collect(metrics, data, metric_name(PREFIX, namespace), ())
+    lines = []
+    for name, samples in metrics.items():
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in samples:
+            labelstr = ','.join('%s="%s"' % (k, label_value(v)) for k, v in labels)
+            lines.append('%s{%s} %s' % (name, labelstr, value) if labelstr else '%s %s' % (name, value))
+    return ('\n'.join(lines) + '\n').encode('utf8') if lines else b''
+
+
+def _collect(metrics, value, name, labels):
+    if isinstance(value, bool):
+        metrics.setdefault(name, []).append((labels, int(value)))
+    elif isinstance(value, (int, float)):
+        if math.isfinite(value):
+            metrics.setdefault(name, []).append((labels, value))
+    elif isinstance(value, dict):
+        for key, subvalue in value.items():
+            _collect(metrics, subvalue, metric_name(name, key), labels)
+    elif isinstance(value, (list, tuple)):
+        itemlabels = [_itemlabel(item) for item in value]
+        counts = Counter(itemlabels)
+        for i, item in enumerate(value):
+            itemlabel = itemlabels[i]
+            if itemlabel:
+                item = {k:v for k, v in item.items() if k != itemlabel[0]}
+                sublabels = labels + ((metric_name(itemlabel[0]), itemlabel[1]),)
+                if counts[itemlabel] > 1:
+                    sublabels += (('index', i),)
+                _collect(metrics, item, name, sublabels)
+            else:
+                _collect(metrics, item, name, labels + (('index', i),))
+
+
+def _itemlabel(item):
+    # (key, value) of the first LABELKEYS key the item has
+    if isinstance(item, dict):
+        for key in LABELKEYS:
+            if item.get(key) not in (None, ''):
+                return key, str(item[key])
+    return None
+
+
+class MetricsExporter(object):
+
+    def __init__(self, port, host='127.0.0.1'):
+        self.lock = threading.Lock()                    # Lock for chunks and body
+        self.chunks = OrderedDict()                     # Rendered metrics by namespace
+        self.body = b''                                 # Cached response body
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        log.info('Serving metrics at http://%s:%s/metrics', host, port)
+
+    def _handler(self):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    return self.send_error(404)
+                body = exporter.body
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug('Metrics request: %s', format % args)
+
+        return Handler
+
+    def update(self, namespace, data):
+        chunk = render(namespace, data)
+        with self.lock:
+            self.chunks[namespace] = chunk
+            self.body = b''.join(self.chunks.values())
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
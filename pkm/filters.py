@@ -13,9 +13,10 @@ MS = ((604800000,'w'), (86400000,'d'), (3600000,'h'), (60000,'m'), (1000,'s'), (
 
 
 filters = {}
-def register_filter(name=None):  # NOQA
+def register_filter(name=None, window=False):  # NOQA
     def wrap1(func):
         regname = name if name else func.__name__
+        func.window = window  # Passed a rolling window rather than the value
         filters[regname] = func
         def wrap2(*args, **kwargs):  # NOQA
             return func(*args, **kwargs)
@@ -33,6 +34,11 @@ def _value_to_str(value, units, precision=0, separator=' '):
     return '0%s%s' % (separator, unit)
 
 
+@register_filter(window=True)
+def avg(window):
+    return window.avg()
+
+
 @register_filter()
 def bytes_to_str(value, precision=0):
     return _value_to_str(value, BYTES1024, precision)
@@ -115,6 +121,11 @@ def lower(value):
     return value.lower()
 
 
+@register_filter('max', window=True)
+def max_(window):
+    return window.max()
+
+
 @register_filter()
 def megabytes_to_str(value, precision=0):
     value = value or 0
@@ -126,6 +137,16 @@ def milliseconds_to_str(value, precision=1, separator=' '):
     return _value_to_str(value, MILLISECONDS, precision)
 
 
+@register_filter('min', window=True)
+def min_(window):
+    return window.min()
+
+
+@register_filter(window=True)
+def p95(window):
+    return window.percentile(95)
+
+
 @register_filter()
 def pluralize(value, arg=',s'):
     if value is None: return ''
@@ -134,6 +155,11 @@ def pluralize(value, arg=',s'):
     return one if count == 1 else many
 
 
+@register_filter(window=True)
+def rate(window):
+    return window.rate()
+
+
 @register_filter('round')
 def round_(value, places=0):
     if value is None: return ''
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter HTTP Client
+Requests made by the plugins and their preferences. Connections are kept
+open and reused per host, responses may be gzipped, and bodies that came
+with an ETag or Last-Modified are kept so the next request for the url can
+be answered with a 304. Each request has a deadline for the whole exchange
+and a limit on the size of the body. The http_proxy, https_proxy and
+no_proxy environment variables are honoured like urllib does.
+"""
+import base64, http.client, socket, ssl, threading, time, zlib
+from collections import OrderedDict
+from concurrent import futures
+from urllib.parse import unquote, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.request import getproxies, proxy_bypass
+from pkm import APPNAME, VERSION, log
+
+MAXIDLE = 4                 # Idle connections kept per host
+MAXCACHE = 64               # Bodies kept for conditional requests
+MAXCACHEBYTES = 8388608     # Total size of the bodies kept (8MB)
+MAXREDIRECTS = 5            # Redirects followed per request
+MAXWORKERS = 8              # Requests run at once by iter_responses
+MAXSIZE = 10485760          # Default body size limit (10MB)
+CHUNKSIZE = 65536           # Bytes read at a time
+REDIRECTS = (301, 302, 303, 307, 308)
+USERAGENT = '%s/%s' % (APPNAME, VERSION)
+
+lock = threading.Lock()     # Lock for pools, cache and failing
+pools = {}                  # Idle connections by (scheme, host, port, proxy)
+cache = OrderedDict()       # Cached responses by url
+cachebytes = 0              # Total size of the cached bodies
+failing = set()             # Urls whose last request failed
+sslcontext = None           # Shared ssl context, created when needed
+executor = None             # Shared request threads, created when needed
+
+
+class HTTPError(Exception):
+    """ Request failed or the server replied with an error status. """
+
+    def __init__(self, message, code=None):
+        super(HTTPError, self).__init__(message)
+        self.code = code
+
+
+class Response(object):
+    """ Completed response; the body is already read and decoded. """
+
+    def __init__(self, url, status, reason, headers, body):
+        self.url = url              # Final url after redirects
+        self.status = status        # HTTP status code
+        self.reason = reason        # HTTP status reason
+        self.headers = headers      # Response headers (HTTPMessage)
+        self.body = body            # Response body bytes
+
+    def read(self):
+        return self.body
+
+
+def request(url, data=None, timeout=30, headers=None, maxsize=MAXSIZE):
+    """ Request url and return a dict with success, response, status and url,
+        or error on failure. data is form encoded and posted. The timeout is
+        the deadline in seconds for the whole request, redirects included.
+        A 304 reply to conditional headers passed in is a success without a
+        response; otherwise cached bodies are revalidated transparently.
+    """
+    log.debug('Requesting URL: %s', url)
+    deadline = time.monotonic() + timeout
+    body = urlencode(data).encode('utf8') if data else None
+    headers = dict(headers or {})
+    conditional = 'If-None-Match' in headers or 'If-Modified-Since' in headers
+    try:
+        requrl = url
+        for i in range(MAXREDIRECTS + 1):
+            cached = None if conditional or body else _cached(requrl, headers)
+            response = _request(requrl, body, headers, deadline, maxsize)
+            if response.status in REDIRECTS and response.headers.get('Location'):
+                requrl = urljoin(requrl, response.headers['Location'])
+                if response.status == 303:
+                    body = None
+                continue
+            break
+        else:
+            raise HTTPError('Too many redirects', response.status)
+        if response.status == 304 and cached:
+            response = cached
+        elif response.status == 304 and conditional:
+            return _result(url, {'success':True, 'response':None, 'status':304, 'url':url})
+        elif response.status >= 400:
+            raise HTTPError('HTTP Error %s: %s' % (response.status, response.reason), response.status)
+        elif not body and not conditional:
+            _cache(requrl, response)
+        return _result(url, {'success':True, 'response':response, 'status':response.status, 'url':url})
+    except Exception as err:
+        return _result(url, {'success':False, 'error':err, 'status':getattr(err, 'code', None), 'url':url})
+
+
+def iter_responses(urls, data=None, timeout=30, headers=None):
+    """ Request urls at most MAXWORKERS at a time, yielding each result as it
+        completes. headers are the extra headers by url. Urls without a
+        result after timeout seconds are yielded as failures; requests that
+        have not started by then (or when the caller stops iterating) are
+        cancelled.
+    """
+    headers = headers or {}
+    deadline = time.monotonic() + timeout
+    pending = {_executor().submit(_deadline_request, url, data, deadline, headers.get(url)):url for url in urls}
+    try:
+        for future in futures.as_completed(pending, timeout=timeout):
+            del pending[future]
+            yield future.result()
+    except futures.TimeoutError:
+        for future, url in list(pending.items()):
+            future.cancel()
+            del pending[future]
+            yield _result(url, {'success':False, 'error':socket.timeout('Request deadline exceeded'), 'status':None, 'url':url})
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _deadline_request(url, data, deadline, headers):
+    # Requests that waited for a thread only get the time that is left
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return _result(url, {'success':False, 'error':socket.timeout('Request deadline exceeded'), 'status':None, 'url':url})
+    return request(url, data, remaining, headers)
+
+
+def _executor():
+    global executor
+    with lock:
+        if executor is None:
+            executor = futures.ThreadPoolExecutor(MAXWORKERS, thread_name_prefix='httpclient')
+        return executor
+
+
+def _result(url, result):
+    # Failures are logged as errors once, until the url works again
+    with lock:
+        if result['success']:
+            if url in failing:
+                failing.discard(url)
+                log.info('Request succeeded again: %s', url)
+        elif url not in failing:
+            failing.add(url)
+            log.error('Error requesting URL: %s; %s', url, result['error'])
+        else:
+            log.debug('Error requesting URL: %s; %s', url, result['error'])
+    return result
+
+
+def _cached(url, headers):
+    # Add the validators of a cached body to headers
+    with lock:
+        cached = cache.get(url)
+        if cached:
+            cache.move_to_end(url)
+            if cached.headers.get('ETag'):
+                headers['If-None-Match'] = cached.headers['ETag']
+            if cached.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = cached.headers['Last-Modified']
+        else:
+            headers.pop('If-None-Match', None)
+            headers.pop('If-Modified-Since', None)
+        return cached
+
+
+def _cache(url, response):
+    # Least recently used bodies are dropped to stay within MAXCACHE entries
+    # and MAXCACHEBYTES in total; bodies over a quarter of that are not kept.
+    global cachebytes
+    if response.status != 200 or len(response.body) > MAXCACHEBYTES // 4:
+        return
+    if not response.headers.get('ETag') and not response.headers.get('Last-Modified'):
+        return
+    with lock:
+        old = cache.pop(url, None)
+        cachebytes += len(response.body) - (len(old.body) if old else 0)
+        cache[url] = response
+        while len(cache) > MAXCACHE or cachebytes > MAXCACHEBYTES:
+            cachebytes -= len(cache.popitem(last=False)[1].body)
+
+
+def _request(url, body, headers, deadline, maxsize):
+    # A reused connection may have been closed by the server while it was
+    # idle; a GET is retried once on a new connection. A POST is not, as the
+    # server may have acted on it before the connection was reset.
+    parts = urlsplit(url)
+    proxy = _proxy(parts)
+    key = (parts.scheme, parts.hostname, parts.port, proxy)
+    path = (parts.path or '/') + ('?%s' % parts.query if parts.query else '')
+    headers = dict(headers, **{'Accept-Encoding':'gzip', 'User-Agent':USERAGENT})
+    if body:
+        headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+    if proxy and parts.scheme == 'http':
+        # Plain http goes to the proxy with the absolute url
+        path = urlunsplit((parts.scheme, parts.netloc, parts.path or '/', parts.query, ''))
+        if proxy[2]:
+            headers['Proxy-Authorization'] = proxy[2]
+    while True:
+        conn, reused = _acquire(key, deadline)
+        try:
+            conn.request('POST' if body else 'GET', path, body, headers)
+            response = conn.getresponse()
+            break
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            conn.close()
+            if not reused or body:
+                raise
+        except:
+            conn.close()
+            raise
+    try:
+        content = _read(response, conn.sock, deadline, maxsize)
+    except:
+        conn.close()
+        raise
+    _release(key, conn, response)
+    return Response(url, response.status, response.reason, response.headers, content)
+
+
+def _read(response, sock, deadline, maxsize):
+    # sock is None when the server closes the connection after this response;
+    # then only the connect timeout applies to each read.
+    gzipped = response.getheader('Content-Encoding', '').lower() == 'gzip'
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+    chunks, size = [], 0
+    while True:
+        _settimeout(sock, deadline)
+        chunk = response.read(CHUNKSIZE)
+        if not chunk:
+            break
+        if decompressor:
+            chunk = decompressor.decompress(chunk, maxsize - size + 1)
+        size += len(chunk)
+        if size > maxsize:
+            raise HTTPError('Response larger than %s bytes' % maxsize)
+        chunks.append(chunk)
+    if decompressor:
+        chunk = decompressor.flush()
+        size += len(chunk)
+        if size > maxsize:
+            raise HTTPError('Response larger than %s bytes' % maxsize)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+def _settimeout(sock, deadline):
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout('Request deadline exceeded')
+    if sock:
+        sock.settimeout(remaining)
+    return remaining
+
+
+def _proxy(parts):
+    # (host, port, authorization) of the proxy for this url, or None
+    proxy = getproxies().get(parts.scheme)
+    if not proxy or proxy_bypass(parts.hostname or ''):
+        return None
+    proxy = urlsplit(proxy if '://' in proxy else 'http://%s' % proxy)
+    auth = None
+    if proxy.username:
+        userpass = '%s:%s' % (unquote(proxy.username), unquote(proxy.password or ''))
+        auth = 'Basic %s' % base64.b64encode(userpass.encode('utf8')).decode('ascii')
+    return proxy.hostname, proxy.port or 80, auth
+
+
+def _acquire(key, deadline):
+    scheme, host, port, proxy = key
+    with lock:
+        idle = pools.get(key)
+        conn = idle.pop() if idle else None
+    if conn:
+        _settimeout(conn.sock, deadline)
+        return conn, True
+    timeout = _settimeout(None, deadline)
+    if scheme == 'https' and proxy:
+        # Tunnel through the proxy with CONNECT; tls is still end to end
+        conn = http.client.HTTPSConnection(proxy[0], proxy[1], timeout=timeout, context=_sslcontext())
+        conn.set_tunnel(host, port, {'Proxy-Authorization':proxy[2]} if proxy[2] else None)
+    elif scheme == 'http' and proxy:
+        conn = http.client.HTTPConnection(proxy[0], proxy[1], timeout=timeout)
+    elif scheme == 'https':
+        conn = http.client.HTTPSConnection(host, port, timeout=timeout, context=_sslcontext())
+    elif scheme == 'http':
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    else:
+        raise HTTPError('Unsupported url scheme: %s' % scheme)
+    return conn, False
+
+
+def _release(key, conn, response):
+    if response.will_close or not conn.sock:
+        return conn.close()
+    with lock:
+        idle = pools.setdefault(key, [])
+        if len(idle) < MAXIDLE:
+            return idle.append(conn)
+    conn.close()
+
+
+def _sslcontext():
+    global sslcontext
+    if sslcontext is None:
+        sslcontext = ssl.create_default_context()
+    return sslcontext
@@ -2,35 +2,127 @@
 """
 PKMeter Charts
 """
-import time
+import hashlib, numpy, os, re, time
+from collections import deque
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
-from pkm import pkmixins, utils
+from pkm import CHARTDIR
+from pkm import log, pkmixins, utils
 from pkm.decorators import threaded_method
 
 
+class RingBuffer(object):
+    """ Preallocated (points x series) history. The max value over the last
+        window points is maintained with a monotonic deque so append is
+        O(series). The window can be smaller than the buffer, which lets a
+        chart change width without throwing away its history.
+    """
+
+    def __init__(self, numpoints, numseries):
+        self.numpoints = numpoints                      # Number of points stored
+        self.numseries = numseries                      # Number of values per point
+        self.data = numpy.full((numpoints, numseries), numpy.nan)
+        self.count = 0                                  # Total points appended
+        self.window = numpoints                         # Number of points in view
+        self.maxes = deque()                            # Decreasing (count, rowmax) pairs
+
+    def _push_max(self, count, rowmax):
+        while self.maxes and self.maxes[-1][1] <= rowmax:
+            self.maxes.pop()
+        self.maxes.append((count, rowmax))
+        while self.maxes[0][0] <= count - self.window:
+            self.maxes.popleft()
+
+    def append(self, values):
+        self.data[self.count % self.numpoints] = values
+        self.count += 1
+        self._push_max(self.count, max(values))
+
+    def extend(self, rows):
+        rows = rows[-self.numpoints:]
+        indices = (self.count + numpy.arange(len(rows))) % self.numpoints
+        self.data[indices] = rows
+        self.count += len(rows)
+        self.set_window(self.window)
+
+    def max(self, default=0):
+        return self.maxes[0][1] if self.maxes else default
+
+    def resized(self, numpoints):
+        buf = RingBuffer(numpoints, self.numseries)
+        buf.extend(self.values(window=min(numpoints, self.numpoints)))
+        return buf
+
+    def set_window(self, window):
+        self.window = window
+        self.maxes = deque()
+        rows = self.values(window=window)
+        start = self.count - len(rows)
+        for i, rowmax in enumerate(numpy.fmax.reduce(rows, axis=1).tolist()):
+            if rowmax == rowmax:  # skip empty (nan) rows
+                self._push_max(start + i + 1, rowmax)
+
+    def values(self, count=None, window=None):
+        # Pass in count when reading from another thread so the
+        # ordering matches the number of points the caller saw.
+        head = (self.count if count is None else count) % self.numpoints
+        window = self.window if window is None else window
+        return numpy.concatenate((self.data[head:], self.data[:head]))[-window:]
+
+
 class PKLineChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
+    PAINT_SAMPLES = 100                                 # Frames per paint time log
 
     def __init__(self, etree, control, parent=None):
         QtWidgets.QFrame.__init__(self)
         self.autoscale = True                           # Autoscale max value
         self.bgcolor = QtGui.QColor(255,255,255,10)     # Chart background color
         self.colors = [QtGui.QColor(255,0,0)]           # Chart line colors
+        self.history = 600                              # Points of history to keep
         self.interval = None                            # Set update sec for smooth scrolling
         self.maxvalue = 1                               # Max value in dataset
         self.minmax = 1                                 # Minimum max value
         self.pxperpt = 3                                # Pixels per point
         self.showzero = True                            # Plot zero values
-        self.data = []
-        self.numpoints = None
+        self.data = None                                # RingBuffer of plotted values
         self.offset = 0
+        self.pixmap = None                              # Cached lines (drawn without offset)
+        self.drawn = (None, 0, None, None)              # Buffer, count, max, and window in pixmap
+        self.painttimes = []                            # Recent paint times (seconds)
         pkmixins.LayoutMixin._init(self, etree, control, parent)
+        self.historypath = self._init_historypath()     # File to persist history to
 
-    def _init_data(self, values, numpoints):
-        self.data = []
-        self.numpoints = numpoints
-        for i in range(self.numpoints):
-            self.data.append([-1] * len(values))
+    def _init_historypath(self):
+        # Charts are identified by id or by their values template. Charts
+        # inside iter blocks ({{this.*}}) are not unique and not persisted.
+        tmplstr = self.etree.attrib.get('values', '')
+        if not self.id and (not tmplstr or '{{this.' in tmplstr):
+            return None
+        chartid = self.id or re.sub(r'[^\w.,]+', '_', tmplstr).strip('_')
+        if len(chartid) > 100:
+            chartid = hashlib.md5(chartid.encode('utf8')).hexdigest()
+        return os.path.join(CHARTDIR, '%s.npy' % chartid)
+
+    def _load_history(self, numseries):
+        data = RingBuffer(self.history, numseries)
+        if self.historypath and os.path.isfile(self.historypath):
+            try:
+                rows = numpy.load(self.historypath, mmap_mode='r')
+                if rows.ndim == 2 and rows.shape[1] == numseries:
+                    data.extend(numpy.array(rows, dtype=float))
+            except Exception as err:
+                log.warning('Unable to load chart history %s: %s', self.historypath, err)
+        return data
+
+    def save_history(self):
+        if not self.historypath or not self.data or not self.data.count:
+            return None
+        os.makedirs(CHARTDIR, exist_ok=True)
+        rows = self.data.values(window=min(self.data.count, self.data.numpoints))
+        handle = numpy.lib.format.open_memmap(self.historypath, mode='w+', dtype=numpy.float32, shape=rows.shape)
+        handle[:] = rows
+        handle.flush()
+        del handle
 
     def attribute_bgcolor(self, value):
         self.bgcolor = utils.hex_to_qcolor(value)
@@ -41,6 +133,9 @@ class PKLineChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
     def attribute_colors(self, value):
         self.colors = [utils.hex_to_qcolor(v) for v in value.split(',')]
 
+    def attribute_history(self, value):
+        self.history = int(value)
+
     def attribute_interval(self, value):
         self.interval = int(float(value))
 
@@ -57,15 +152,18 @@ class PKLineChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
     def attribute_values(self, values):
         if not values: return None
         values = [float(v) for v in values.split(',')]
-        self.showit = False
-        if len(values) == 2:
-            self.showit = True
-        numpoints = int(self.width() / self.pxperpt)
-        if not self.data or numpoints != self.numpoints:
-            self._init_data(values, numpoints)
-        self.data = self.data[1:] + [values]
+        numpoints = max(1, int(self.width() / self.pxperpt))
+        if not self.data:
+            self.data = self._load_history(len(values))
+        if len(values) != self.data.numseries:
+            self.data = RingBuffer(max(self.history, numpoints), len(values))
+        if numpoints > self.data.numpoints:
+            self.data = self.data.resized(numpoints)
+        if numpoints != self.data.window:
+            self.data.set_window(numpoints)
+        self.data.append(values)
         if self.autoscale:
-            self.maxvalue = max([max(x) for x in self.data] + [self.minmax])
+            self.maxvalue = max(self.data.max(), self.minmax)
             self.setToolTip('Max: %s' % self.maxvalue)
         if self.interval:
             loops = self.interval * 10
@@ -78,7 +176,9 @@ class PKLineChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
 
     def paintEvent(self, event):
         if not self.data: return
+        started = time.time()
         QtWidgets.QFrame.paintEvent(self, event)
+        self._update_pixmap()
         painter = QtGui.QPainter()
         painter.begin(self)
         painter.setRenderHint(QtGui.QPainter.Antialiasing)
@@ -86,27 +186,77 @@ class PKLineChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
         painter.setBrush(QtGui.QBrush(self.bgcolor))
         painter.setPen(Qt.NoPen)
         painter.drawRoundedRect(self.contentsRect(), 2, 2)
-        # Draw the Lines
-        for i in range(len(self.data[0])):
-            path = None
-            pen = QtGui.QPen(self.colors[i % len(self.colors)])
-            for j in range(len(self.data)):
-                value = self.data[j][i]
-                prevvalue = self.data[j-1][i]
-                if value == -1 or prevvalue == -1:
-                    continue
-                if not self.showzero and value <= 0 and prevvalue <= 0:
-                    continue
-                x1 = (self.pxperpt * (j - 0.5) + self.pxperpt / 4) - self.offset
-                x2 = (self.pxperpt * j + self.pxperpt / 4) - self.offset
-                y1 = self.height() - int((self.height() - 1) * (prevvalue / self.maxvalue))
-                y2 = self.height() - int((self.height() - 1) * (value / self.maxvalue))
-                path = path or QtGui.QPainterPath(QtCore.QPointF(x1,y1))
+        # Blit the cached lines at the current scroll offset
+        painter.drawPixmap(QtCore.QPointF(-self.offset, 0), self.pixmap)
+        painter.end()
+        self._log_painttime(time.time() - started)
+
+    def _update_pixmap(self):
+        # Only new points are drawn; the existing pixels are scrolled left to
+        # make room. Everything is redrawn when the size or scale changes.
+        data, count, maxvalue, window = self.data, self.data.count, self.maxvalue, self.data.window
+        drawndata, drawncount, drawnmax, drawnwindow = self.drawn
+        newpoints = count - drawncount
+        if (not self.pixmap or self.pixmap.size() != self.size() or data is not drawndata
+           or maxvalue != drawnmax or window != drawnwindow or newpoints >= window - 1):
+            self.pixmap = QtGui.QPixmap(self.size())
+            self.pixmap.fill(Qt.transparent)
+            self._draw_segments(data, count, maxvalue, window, 1)
+        elif newpoints:
+            dx = newpoints * self.pxperpt
+            self.pixmap.scroll(-dx, 0, self.pixmap.rect())
+            clearx = int(self._xcoords(window - 1 - newpoints)) + 1
+            painter = QtGui.QPainter(self.pixmap)
+            painter.setCompositionMode(QtGui.QPainter.CompositionMode_Clear)
+            painter.fillRect(clearx, 0, self.pixmap.width() - clearx, self.pixmap.height(), Qt.transparent)
+            painter.end()
+            self._draw_segments(data, count, maxvalue, window, window - newpoints)
+        self.drawn = (data, count, maxvalue, window)
+
+    def _xcoords(self, j):
+        return j * self.pxperpt + self.pxperpt / 4
+
+    def _draw_segments(self, data, count, maxvalue, window, first):
+        # Segment j is drawn from point j-1 to point j when both points
+        # have a value. Coordinates for all points are calculated at once.
+        values = data.values(count, window)
+        height = self.height()
+        empty = numpy.isnan(values)
+        ys = height - ((height - 1) * (numpy.nan_to_num(values) / maxvalue)).astype(int)
+        xs2 = self._xcoords(numpy.arange(len(values)))
+        xs1 = xs2 - self.pxperpt / 2
+        drawable = ~(empty[1:] | empty[:-1])
+        if not self.showzero:
+            drawable &= (values[1:] > 0) | (values[:-1] > 0)
+        drawable = numpy.vstack((numpy.zeros((1, data.numseries), bool), drawable))
+        xs1, xs2 = xs1.tolist(), xs2.tolist()
+        painter = QtGui.QPainter(self.pixmap)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        for i in range(data.numseries):
+            path, prevj = None, None
+            series = ys[:,i].tolist()
+            for j in (numpy.flatnonzero(drawable[first:,i]) + first).tolist():
+                x1, x2, y1, y2 = xs1[j], xs2[j], series[j-1], series[j]
+                if prevj != j - 1:
+                    # Continue from the previous point if its segment is
+                    # already in the pixmap, otherwise start a new line.
+                    path = path or QtGui.QPainterPath()
+                    if drawable[j-1,i]: path.moveTo(xs2[j-1], y1)
+                    else: path.moveTo(x1, y1)
                 path.cubicTo(x1, y1, x1, y2, x2, y2)
+                prevj = j
             if path:
+                pen = QtGui.QPen(self.colors[i % len(self.colors)])
                 painter.strokePath(path, pen)
         painter.end()
 
+    def _log_painttime(self, painttime):
+        self.painttimes.append(painttime)
+        if len(self.painttimes) >= self.PAINT_SAMPLES:
+            avgtime = sum(self.painttimes) / len(self.painttimes)
+            log.debug('Linechart %s avg paint time: %.3fms/frame', self.objectName(), avgtime * 1000)
+            self.painttimes = []
+
 
 class PKPieChart(QtWidgets.QFrame, pkmixins.LayoutMixin):
 
@@ -172,8 +172,8 @@ class PKConfig(PKWidget):
             return self.load_message('No configuration for this module.')
         for field in pconfig.fields.values():
             pconfig._validate(field, force=True)
-        pconfig.setParent(self.manifest.contents)
-        self.manifest.contents.layout().addWidget(pconfig)
+        pconfig.frame.setParent(self.manifest.contents)
+        self.manifest.contents.layout().addWidget(pconfig.frame)
 
     def load_tab_data(self, refresh=False):
         namespace = self.manifest.list.currentItem().data(NAMESPACE_ROLE)
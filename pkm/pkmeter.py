@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Desktop App
+"""
+import json, os, signal, threading, time
+from collections import defaultdict
+from PyQt5 import QtCore, QtWidgets
+from xml.etree import ElementTree
+from pkm import HISTORYDIR, SHAREDIR, STATUSFILE, THEMEDIR
+from pkm import log, pkcharts, pkwidgets, utils
+from pkm.about import AboutWindow
+from pkm.collector import Collector
+from pkm.decorators import threaded_method
+from pkm.pkconfig import PKConfig
+from pkm.timeseries import TimeSeriesStore
+
+
+class PKMeter(QtCore.QObject, Collector):
+    """ PKMeter Desktop System Monitor """
+    plugin_updated = QtCore.pyqtSignal(object)
+
+    def __init__(self, opts):
+        super(PKMeter, self).__init__()
+        log.setLevel(opts.loglevel)                     # Set the log level
+        self.opts = opts                                # Command line options
+        self.theme = self._init_theme()                 # Bunch contains {name, dir}
+        self.rlock = threading.RLock()                  # Lock for updates
+        self.data = {}                                  # Cached data from all namespaces
+        self.history = TimeSeriesStore(HISTORYDIR)      # History of all numeric values
+        self.exporter = self._init_exporter()           # Optional metrics endpoint
+        self._init_searchpath()                         # Init image resources
+        self.plugin_updated.connect(self.update)        # Plugin updated signal handler
+        self.modules = self._load_modules()             # Import all plugins
+        self.about = AboutWindow()                      # About Window
+        self.config = PKConfig(self)                    # Config Values and Window
+        self.plugins = self._init_plugins()             # Init plugins (but dont start yet)
+        self.widgets = self._init_widgets()             # List of PKMeter windows
+        self.actions = self._init_actions()             # actions to update (organized by namespace)
+        self._start_plugins()                           # Start all required plugins
+        signal.signal(signal.SIGINT, self.quit)         # Quit on Ctrl+C
+
+    def _init_theme(self):
+        log.info('--- Starting PKMeter ---')
+        theme = utils.Bunch()
+        theme.name = self.opts.theme.lower()
+        theme.dir = os.path.join(THEMEDIR, theme.name)
+        return theme
+
+    def _init_searchpath(self):
+        imgdir = os.path.join(SHAREDIR, 'img')
+        QtCore.QDir.addSearchPath('img', imgdir)
+
+    def _init_actions(self):
+        actions = defaultdict(list)
+        for widget in self.widgets:
+            for action in widget.actions:
+                if getattr(action, 'namespaces', None):
+                    for namespace in action.namespaces:
+                        actions[namespace].append(action)
+                elif getattr(action, 'namespace', None):
+                    actions[action.namespace].append(action)
+        return actions
+
+    def _init_widgets(self):
+        widgets = []
+        stylepath = os.path.join(self.theme.dir, 'style.css')
+        with open(stylepath) as handle:
+            style = handle.read()
+        layoutpath = os.path.join(self.theme.dir, 'layout.html')
+        with open(layoutpath) as handle:
+            etree = ElementTree.fromstring('<root>%s</root>' % handle.read())
+        for ewidget in etree:
+            if ewidget.tag.lower() != 'widget':
+                raise Exception('Top level layout tags must be widget not %s.' % ewidget.tag)
+            widget = pkwidgets.PKDeskWidget(ewidget, style, self)
+            widget.setPosition('5500,0')  # Force starting in top right
+            widget.show()
+            widgets.append(widget)
+        return widgets
+
+    def _update_status_file(self):
+        ts = lambda d: int(time.mktime(d.timetuple())) if d else 'NA'
+        status = {p:ts(d.get('lastupdate')) for p,d in self.data.items() if p != 'this' and d.get('enabled')}
+        with open(STATUSFILE, 'w') as handle:
+            json.dump(status, handle, indent=2)
+
+    def _save_charts(self):
+        for widget in self.widgets:
+            for chart in widget.findChildren(pkcharts.PKLineChart):
+                try:
+                    chart.save_history()
+                except Exception as err:
+                    log.warning('Unable to save chart history %s: %s', chart.historypath, err)
+
+    def iter_limit(self, varpath):
+        """ Max rows shown for iter=varpath, or None if any are not limited. """
+        limits = []
+        for action in self.actions.get(varpath.split('.')[0], []):
+            callback = getattr(action, 'callback', None)
+            if getattr(action, 'varpath', None) == varpath and getattr(callback, '__name__', None) == 'attribute_iter':
+                limits.append(callback.__self__.itermax)
+        return None if not limits or None in limits else max(limits)
+
+    def resize_to_min(self):
+        for widget in self.widgets:
+            widget.resize(widget.minimumSizeHint())
+
+    @threaded_method
+    def reload(self):
+        log.info('--- Reloading PKMeter ---')
+        for plugin in self.plugins.values():
+            oldenabled = plugin.enabled
+            newenabled = self.config.get(plugin.namespace, 'enabled', True)
+            if oldenabled != newenabled:
+                try:
+                    plugin.enable()
+                except:
+                    log.exception('Error reloading plugin: %s', plugin)
+                    plugin.disable()
+            else:
+                plugin.reload()
+
+    def update(self, plugin):
+        with self.rlock:
+            namespace = Collector.update(self, plugin)
+            for action in self.actions[namespace]:
+                action.apply(self.data)
+            if namespace == 'clock' and int(time.time()) % 10 == 0:
+                self._update_status_file()
+
+    def quit(self, *args):
+        log.info('Quitting..')
+        self.config.save()
+        self._save_charts()
+        self.history.close()
+        if self.exporter:
+            self.exporter.close()
+        QtCore.QCoreApplication.quit()
+
+
+def start_pkmeter(opts):
+    app = QtWidgets.QApplication(['PKMeter'])
+    PKMeter(opts)
+    app.exec_()
+
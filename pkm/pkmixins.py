@@ -2,10 +2,10 @@
 """
 PKMeter Mixins
 """
-import json, pkm, re, time, urllib
+import json, pkm, re, time
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
-from pkm import log, utils
+from pkm import httpclient, log, utils
 from pkm.decorators import threaded_method
 from pkm.exceptions import ParseError
 from pkm.template import Template, TruthTemplate, Variable
@@ -135,8 +135,9 @@ class LayoutMixin:
         # If http fetch and store image bytes,
         # otherwise store resource location string.
         if value.startswith('http'):
-            log.debug('Opening URL: %s', value)
-            response = urllib.request.urlopen(value)
+            response = httpclient.request(value).get('response')
+            if not response:
+                return
             value = response.read()
         # Exit out if image hasnt changed
         if value == self.bgimage:
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Plex Connections
+One PlexServer per host shared by the Plex plugins and their preferences.
+MyPlex auth tokens are kept so reconnecting does not sign in again, and all
+requests go through one keep-alive session.
+"""
+import requests, threading
+from plexapi.exceptions import Unauthorized
+from plexapi.myplex import MyPlexAccount
+from plexapi.server import PlexServer
+from pkm import log
+
+lock = threading.Lock()         # Lock for the dicts below; not held while connecting
+hostlocks = {}                  # Lock held while connecting by (username, host)
+connections = {}                # Connected PlexServer by (username, host)
+tokens = {}                     # MyPlex auth tokens by username
+session = requests.Session()    # Shared keep-alive session
+
+
+def get_plex(pkmeter, username=None, password=None, host=None, reconnect=False):
+    """ Shared PlexServer for the plexserver settings or the values given. With
+        reconnect, a new connection is made (signing in again) and replaces
+        the shared one only if it succeeds.
+    """
+    username = username or pkmeter.config.get('plexserver', 'username', from_keyring=True)
+    password = password or pkmeter.config.get('plexserver', 'password', from_keyring=True)
+    host = host or pkmeter.config.get('plexserver', 'host', '')
+    key = (username, host)
+    with lock:
+        hostlock = hostlocks.setdefault(key, threading.Lock())
+    with hostlock:
+        with lock:
+            plex = None if reconnect else connections.get(key)
+        if plex is None:
+            plex = _connect(username, password, host, cached=not reconnect)
+            with lock:
+                connections[key] = plex
+        return plex
+
+
+def _connect(username, password, host, cached=True):
+    if username:
+        account = signin(username, password, cached)
+        log.info('Connecting to Plex server %s as %s', host, username)
+        return account.resource(host).connect()
+    log.info('Connecting to Plex host: %s', host)
+    return PlexServer(host, session=session)
+
+
+def signin(username, password, cached=True):
+    """ MyPlexAccount from the cached token, signing in when there is none or
+        it was rejected.
+    """
+    with lock:
+        token = tokens.get(username) if cached else None
+    if token:
+        try:
+            return MyPlexAccount(token=token, session=session)
+        except Unauthorized:
+            log.info('MyPlex token for %s expired.', username)
+    log.info('Logging into MyPlex with user %s', username)
+    account = MyPlexAccount(username, password, session=session)
+    with lock:
+        tokens[username] = account.authenticationToken
+    return account
+
+
+def plex_query(pkmeter, func):
+    """ Return func(plex) using the shared server. If the token was rejected or
+        the connection dropped, reconnect and try once more.
+    """
+    try:
+        return func(get_plex(pkmeter))
+    except (Unauthorized, requests.ConnectionError) as err:
+        log.info('Plex request failed, reconnecting: %s', err)
+        return func(get_plex(pkmeter, reconnect=True))
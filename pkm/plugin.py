@@ -2,18 +2,19 @@
 """
 Plugin Abstract Class
 """
-import os, threading, time
+import os, random, threading, time
+from datetime import datetime
 from pkm import SHAREDIR
 from pkm import log, utils
 from pkm.decorators import never_raise, threaded_method
 from pkm.exceptions import ValidationError
-from pkm.pkwidgets import PKVFrame
-from PyQt5 import QtCore
 from xml.etree import ElementTree
 
 
 class BasePlugin(threading.Thread):
     DEFAULT_INTERVAL = 60
+    FAILURES = 3            # Failed updates in a row before backing off
+    MAX_BACKOFF = 3600      # Max seconds between attempts while backing off
 
     def __init__(self, pkmeter, *args, **kwargs):
         super(BasePlugin, self).__init__(*args, **kwargs)
@@ -24,11 +25,13 @@ class BasePlugin(threading.Thread):
         self.enabled = False                                        # False if plugin disabled
         self.interval = self.get_interval()                         # Get the current interval
         self.next_update = time.time()                              # Update immediatly
+        self.failures = 0                                           # Failed updates in a row
         self.data = {'interval':self.interval}                      # Data returned to PKMeter
 
     def enable(self):
         self.interval = self.get_interval()
         self.next_update = time.time()
+        self.failures = 0
         self.enabled = self.pkmeter.config.get(self.namespace, 'enabled', True)
         if not self.enabled:
             log.info('%s plugin disabled in preferences.' % self.name)
@@ -50,6 +53,7 @@ class BasePlugin(threading.Thread):
     def reload(self):
         log.info('Reloading plugin %s.' % self.name)
         self.next_update = time.time()
+        self.failures = 0
 
     def get_interval(self):
         return float(self.pkmeter.config.get(self.namespace, 'interval', self.DEFAULT_INTERVAL))
@@ -64,11 +68,41 @@ class BasePlugin(threading.Thread):
 
     @never_raise
     def update(self):
+        self.failures = 0
         self.data['enabled'] = self.enabled
+        self.data['circuit'] = {'state':'closed', 'failures':0, 'retry':None}
+        self.data['offline'] = False
         self.pkmeter.plugin_updated.emit(self)
 
+    def failure(self):
+        """ Record a failed update instead of calling update(). After FAILURES
+            in a row the circuit opens: the next attempt is pushed back by
+            an exponential backoff with jitter until an update succeeds.
+            The state is published as circuit and offline.
+        """
+        self.failures += 1
+        offline = self.failures >= self.FAILURES
+        if offline:
+            exponent = min(self.failures - self.FAILURES + 1, 16)  # Keep it finite
+            backoff = min(self.MAX_BACKOFF, self.interval * 2 ** exponent)
+            delay = random.uniform(backoff / 2, backoff)
+            self.next_update = time.time() + delay
+            loglevel = log.warning if self.failures == self.FAILURES else log.info
+            loglevel('%s offline after %s failed updates; retrying in %.0fs.', self.name, self.failures, delay)
+        self.data['enabled'] = self.enabled
+        self.data['circuit'] = {
+            'state': 'open' if offline else 'closed',
+            'failures': self.failures,
+            'retry': datetime.fromtimestamp(self.next_update),
+        }
+        self.data['offline'] = offline
+        self.pkmeter.plugin_updated.emit(self)
 
-class BaseConfig(PKVFrame):
+
+class BaseConfig(object):
+    """ Preferences for a plugin. The settings frame is a PKVFrame built from
+        TEMPLATE; Qt is only imported here so the plugins load without it.
+    """
     STATUS_OK = '✔'
     STATUS_ERROR = '✘'
     STATUS_LOADING = '…'
@@ -83,7 +117,8 @@ class BaseConfig(PKVFrame):
         self.namespace = utils.namespace(self.__module__)           # Namespace of this Config
         self.template = self._init_template()                       # Template for config settings
         self.fields = utils.Bunch()                                 # Fields in this Config
-        PKVFrame.__init__(self, self.template, self)                # Init parent widget
+        self.frame = self._init_frame()                             # Settings widget
+        self.manifest = self.frame.manifest                         # Widgets in the settings frame
         self.pkmeter = pkmeter                                      # Reference to PKMeter
         self.pkconfig = pkconfig                                    # Reference to Main Config
         self._init_default_interval()
@@ -94,6 +129,10 @@ class BaseConfig(PKVFrame):
             template = ElementTree.fromstring(tmpl.read())
         return template
 
+    def _init_frame(self):
+        from pkm.pkwidgets import PKVFrame
+        return PKVFrame(self.template, self)
+
     def _init_default_interval(self):
         if 'interval' in self.FIELDS:
             module = self.pkmeter.modules[self.namespace]
@@ -162,15 +201,3 @@ class BaseConfig(PKVFrame):
         except:
             raise ValidationError('Interval seconds must be a number 1-3600.')
 
-
-class EventFilter(QtCore.QObject):
-
-    def __init__(self, callback, *args):
-        super(EventFilter, self).__init__()
-        self.callback = callback
-        self.args = args
-
-    def eventFilter(self, widget, event):
-        if event.type() == QtCore.QEvent.FocusOut:
-            self.callback(*self.args)
-        return False
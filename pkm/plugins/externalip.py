@@ -4,7 +4,7 @@ Plex Server
 Who is watching what?
 """
 import os, re
-from pkm import utils, SHAREDIR
+from pkm import httpclient, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
 
@@ -23,11 +23,12 @@ class Plugin(BasePlugin):
 
     @never_raise
     def update(self):
-        response = utils.http_request(self.update_url).get('response')
-        if response:
-            content = response.read().decode('utf-8')
-            matches = re.findall(REGEX_IP, content)
-            self.data['ip'] = matches[0] if matches else ''
+        response = httpclient.request(self.update_url).get('response')
+        if not response:
+            return self.failure()
+        content = response.read().decode('utf-8')
+        matches = re.findall(REGEX_IP, content)
+        self.data['ip'] = matches[0] if matches else ''
         super(Plugin, self).update()
 
 
@@ -3,14 +3,16 @@
 FileSystem Plugin
 FileSystem usage
 """
-import os, psutil, time
-from pkm import utils, SHAREDIR
+import os, psutil, select, threading, time
+from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
 from pkm.filters import register_filter
 
 NAME = 'File System'
 DEFAULT_FSTYPES = 'cifs ext nfs vfat'
+USAGE_DEADLINE = 1  # Seconds to wait for disk usage before showing the last value
+SECTOR_SIZE = 512   # Bytes per sector in /proc/diskstats
 
 
 class Plugin(BasePlugin):
@@ -20,16 +22,31 @@ class Plugin(BasePlugin):
     def enable(self):
         self.fstypes = self.pkmeter.config.get(self.namespace, 'fstypes', '')
         self.fstypes = list(filter(None, self.fstypes.split(' ')))
+        self.watcher = getattr(self, 'watcher', None) or MountWatcher()
+        self.partitions = None      # Interesting partitions from the mount table
+        self.checks = getattr(self, 'checks', {})  # UsageCheck by mountpoint
+        self.diskstats = DiskStats()
         super(Plugin, self).enable()
 
     @never_raise
     def update(self):
+        if self.partitions is None or self.watcher.changed():
+            self.partitions = [self._disk(d) for d in psutil.disk_partitions(all=True) if self._interesting(d.fstype)]
+            checks = {d['mountpoint']:self.checks.pop(d['mountpoint'], None) or UsageCheck(d['mountpoint']) for d in self.partitions}
+            for check in self.checks.values():
+                check.close()  # Unmounted
+            self.checks = checks
+        for check in self.checks.values():
+            check.start()
+        iorates = self.diskstats.update()
+        deadline = time.monotonic() + USAGE_DEADLINE
         disks = []
-        for disk in psutil.disk_partitions(all=True):
-            if self._interesting(disk.fstype):
-                disk = self._disk(disk)
-                disk.update(self._disk_usage(disk['mountpoint']))
-                disks.append(disk)
+        for disk in self.partitions:
+            check = self.checks[disk['mountpoint']]
+            disk = dict(disk, stale=not check.done.wait(max(0, deadline - time.monotonic())))
+            disk.update(check.usage or {})
+            disk['io'] = iorates.get(disk['blockdev'], {})
+            disks.append(disk)
         self.data['disks'] = sorted(disks, key=lambda d:d['mountpoint'].lower())
         self.data['io'] = self._deltas(self.data.get('io',{}), self._disk_io_counters())
         super(Plugin, self).update()
@@ -41,23 +58,16 @@ class Plugin(BasePlugin):
         return False
 
     def _disk(self, disk):
+        # blockdev is the name in /proc/diskstats, ie: /dev/mapper/root -> dm-0
+        blockdev = os.path.basename(os.path.realpath(disk.device)) if disk.device.startswith('/dev/') else None
         return {
+            'blockdev': blockdev,
             'device': disk.device,
             'mountpoint': disk.mountpoint,
             'fstype': disk.fstype,
             'opts': disk.opts,
         }
 
-    def _disk_usage(self, mountpoint):
-        usage = psutil.disk_usage(mountpoint)
-        return {
-            'total': usage.total,
-            'used': usage.used,
-            'free': usage.free,
-            'percent': usage.percent,
-            'percent_free': 100 - usage.percent,
-        }
-
     def _disk_io_counters(self):
         io = psutil.disk_io_counters()
         return {
@@ -79,6 +89,121 @@ class Plugin(BasePlugin):
         return newrw
 
 
+class DiskStats(object):
+    """ Per block device io rates from one read of /proc/diskstats. """
+    PATH = '/proc/diskstats'
+
+    def __init__(self):
+        self.prev = {}          # Previous counters by device name
+        self.prevtime = None    # Monotonic time of previous read
+
+    def update(self):
+        now = time.monotonic()
+        stats = {}
+        try:
+            with open(self.PATH, 'rb') as handle:
+                for line in handle.read().split(b'\n'):
+                    fields = line.split()
+                    if len(fields) >= 14:
+                        stats[fields[2].decode()] = [int(x) for x in fields[3:13]]
+        except OSError:
+            return {}
+        rates = {}
+        if self.prevtime is not None:
+            tdelta = now - self.prevtime
+            for name, values in stats.items():
+                if name in self.prev:
+                    rates[name] = self._rates([max(0, a - b) for a, b in zip(values, self.prev[name])], tdelta)
+        self.prev, self.prevtime = stats, now
+        return rates
+
+    def _rates(self, delta, tdelta):
+        # reads, rmerged, rsectors, rms, writes, wmerged, wsectors, wms, inflight, ioms
+        reads, writes = delta[0], delta[4]
+        ios = reads + writes
+        return {
+            'read_bytes_per_sec': int(delta[2] * SECTOR_SIZE / tdelta),
+            'write_bytes_per_sec': int(delta[6] * SECTOR_SIZE / tdelta),
+            'io_per_sec': int((delta[2] + delta[6]) * SECTOR_SIZE / tdelta),
+            'read_iops': round(reads / tdelta, 1),
+            'write_iops': round(writes / tdelta, 1),
+            'await_ms': round((delta[3] + delta[7]) / ios, 2) if ios else 0.0,
+            'util_percent': round(min(100, delta[9] / (tdelta * 10)), 1),
+        }
+
+
+class MountWatcher(object):
+    """ Tells when the mount table changed; /proc/self/mountinfo polls with
+        POLLPRI after every mount or unmount. Always True without poll.
+    """
+    PATH = '/proc/self/mountinfo'
+
+    def __init__(self):
+        self.handle = None
+        self.poller = None
+        try:
+            self.handle = open(self.PATH, 'rb')
+            self.poller = select.poll()
+            self.poller.register(self.handle, select.POLLERR | select.POLLPRI)
+        except (AttributeError, OSError) as err:
+            log.info('Unable to watch %s, reading mounts every update: %s', self.PATH, err)
+
+    def changed(self):
+        return not self.poller or bool(self.poller.poll(0))
+
+
+class UsageCheck(object):
+    """ Disk usage for a mountpoint read by its own daemon worker thread. A
+        hung network mount only blocks its own worker, and the mount is
+        skipped while its last check is still pending. Workers are not
+        pooled in an executor because those are joined at exit, which would
+        hang quitting.
+    """
+
+    def __init__(self, mountpoint):
+        self.mountpoint = mountpoint                # Mountpoint to check
+        self.usage = None                           # Last good usage
+        self.done = threading.Event()               # Set when no check is pending
+        self.done.set()
+        self.wanted = threading.Event()             # Set to wake the worker
+        self.closed = False                         # Set to stop the worker
+        self.thread = threading.Thread(target=self._run, name='usage:%s' % mountpoint)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def start(self):
+        if self.done.is_set():
+            self.done.clear()
+            self.wanted.set()
+
+    def close(self):
+        self.closed = True
+        self.wanted.set()
+
+    def _run(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if self.closed:
+                return
+            self._check()
+
+    def _check(self):
+        try:
+            usage = psutil.disk_usage(self.mountpoint)
+            self.usage = {
+                'total': usage.total,
+                'used': usage.used,
+                'free': usage.free,
+                'percent': usage.percent,
+                'percent_free': 100 - usage.percent,
+            }
+        except OSError as err:
+            log.warning('Unable to read disk usage for %s: %s', self.mountpoint, err)
+        finally:
+            self.done.set()
+
+
 class Config(BaseConfig):
     TEMPLATE = os.path.join(SHAREDIR, 'templates', 'filesystem_config.html')
     FIELDS = utils.Bunch(BaseConfig.FIELDS,
@@ -3,44 +3,53 @@
 GCal Plugin
 Google Calendar Events
 """
-import datetime, os, webbrowser
-from dateutil import relativedelta, tz
-from icalendar import Calendar
-from PyQt5 import QtWidgets
-from pkm import log, utils, SHAREDIR
+import datetime, hashlib, json, os, re, webbrowser
+from dateutil import relativedelta, rrule, tz
+from icalendar import Calendar, Event
+from pkm import httpclient, log, utils, CACHEDIR, SHAREDIR
 from pkm.decorators import never_raise
 from pkm.exceptions import ValidationError
 from pkm.plugin import BasePlugin, BaseConfig
 from pkm.filters import register_filter
 
 NAME = 'Google Calendar'
-TDELTAS = {
-    'YEARLY': relativedelta.relativedelta(years=1),
-    'MONTHLY': relativedelta.relativedelta(months=1),
-    'WEEKLY': datetime.timedelta(weeks=1),
-    'DAILY': datetime.timedelta(days=1)
-}
+JUMPS = {'YEARLY':('months',12), 'MONTHLY':('months',1), 'WEEKLY':('days',7), 'DAILY':('days',1)}
+CACHE_VERSION = 2
+WINDOW = datetime.timedelta(days=14)
+CALNAME_REGEX = re.compile(r'^X-WR-CALNAME:(.*?)\r?$', re.M)
+VERSION_REGEX = re.compile(r'^VERSION:(.*?)\r?$', re.M)
+DTSTART_REGEX = re.compile(r'^(?:DTSTART|RECURRENCE-ID)[^:\r\n]*:(\d{8})', re.M)
+RRULE_REGEX = re.compile(r'^RRULE:(.*?)\r?$', re.M)
+UNTIL_REGEX = re.compile(r'UNTIL=(\d{8})')
 
 
 class Plugin(BasePlugin):
     DEFAULT_INTERVAL = 600
     DELTANONE = datetime.datetime.now()
 
+    def __init__(self, *args, **kwargs):
+        super(Plugin, self).__init__(*args, **kwargs)
+        self.cache = EventCache()
+        self.starts = {}            # Occurrences by (start, rrule) for startsday
+        self.startsday = None       # Day the occurrences were expanded for
+
     @never_raise
     def update(self):
         self.data['events'] = []
         self.tzutc = tz.tzutc()
         self.tzlocal = tz.tzlocal()
-        urls, colors = [], {}
-        for cal in self._iter_calendars():
-            urls.append(cal.url)
-            colors[cal.url] = cal.color
-        for result in utils.iter_responses(urls, timeout=5):
+        calendars = {cal.url:cal for cal in self._iter_calendars()}
+        headers = {url:self.cache.headers(cal.baseurl) for url, cal in calendars.items()}
+        for result in httpclient.iter_responses(list(calendars), timeout=5, headers=headers):
+            cal = calendars[result.get('url')]
             response = result.get('response')
             if response:
-                ical = Calendar.from_ical(response.read().decode('utf-8'))
-                color = colors[result.get('url')]
-                self.data['events'] += self._parse_events(ical, color)
+                self.cache.set(cal.baseurl, self._parse_calendar(response))
+            elif result.get('status') == 304:
+                log.debug('Calendar not modified: %s', cal.baseurl)
+            cached = self.cache.get(cal.baseurl)
+            if cached:
+                self.data['events'] += self._window_events(cached, cal.color)
         self.data['events'] = sorted(self.data['events'], key=lambda e:e['start'])
         # Calculate time to next event
         now = datetime.datetime.now()
@@ -54,37 +63,130 @@ class Plugin(BasePlugin):
             baseurl = self.pkmeter.config.get(self.namespace, 'cal%s' % i)
             url = Plugin.build_url(baseurl)
             color = self.pkmeter.config.get(self.namespace, 'color%s' % i)
-            if baseurl: yield utils.Bunch({'url':url, 'color':color})
+            if baseurl: yield utils.Bunch({'url':url, 'baseurl':baseurl, 'color':color})
+
+    def _parse_calendar(self, response):
+        # Events that ended before today are dropped from the raw text; only
+        # the rest are parsed and kept as slim records. Lines are unfolded
+        # first so the regexes see whole properties.
+        text = response.read().decode('utf-8')
+        text = text.replace('\r\n ', '').replace('\r\n\t', '').replace('\n ', '').replace('\n\t', '')
+        header = text.split('BEGIN:VEVENT', 1)[0]
+        title = CALNAME_REGEX.search(header) or VERSION_REGEX.search(header)
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
+        mindate = (today - datetime.timedelta(days=1)).strftime('%Y%m%d')
+        events = []
+        for block in text.split('BEGIN:VEVENT')[1:]:
+            block = 'BEGIN:VEVENT' + block[:block.find('END:VEVENT')] + 'END:VEVENT\r\n'
+            if self._may_occur(block, mindate):
+                event = self._parse_event(Event.from_ical(block))
+                if event['rrule'] or max(event['start'], event['recurrence_id'] or '') >= today.isoformat():
+                    events.append(event)
+        return {
+            'etag': response.headers.get('ETag'),
+            'modified': response.headers.get('Last-Modified'),
+            'title': title.group(1) if title else '',
+            'events': events,
+        }
+
+    def _may_occur(self, block, mindate):
+        # Compare the yyyymmdd prefix of DTSTART, RECURRENCE-ID or RRULE UNTIL;
+        # mindate is a day early to cover timezones.
+        rrule = RRULE_REGEX.search(block)
+        if rrule:
+            until = UNTIL_REGEX.search(rrule.group(1))
+            return not until or until.group(1) >= mindate
+        dates = DTSTART_REGEX.findall(block)
+        return not dates or max(dates) >= mindate
+
+    def _parse_event(self, event):
+        recurrence_id = event.get('recurrence-id')
+        return {
+            'uid': self._str(event.get('uid')),
+            'title': self._str(event.get('summary')),
+            'where': self._str(event.get('location')),
+            'status': self._str(event.get('description')),
+            'start': self._fix_dt(event.get('dtstart').dt).isoformat(),
+            'rrule': self._rrule(event.get('rrule')),
+            'exdates': [self._fix_dt(dt).isoformat() for dt in self._exdates(event)],
+            'recurrence_id': self._fix_dt(recurrence_id.dt).isoformat() if recurrence_id else None,
+        }
+
+    def _rrule(self, recur):
+        # UNTIL is converted like DTSTART so both are naive local times
+        if not recur:
+            return None
+        recur = recur[0] if isinstance(recur, list) else recur
+        recur = recur.__class__(recur)
+        if recur.get('UNTIL'):
+            recur['UNTIL'] = [self._fix_dt(min(recur['UNTIL']))]
+        return recur.to_ical().decode('utf8')
+
+    def _exdates(self, event):
+        exdates = event.get('exdate') or []
+        for exdate in exdates if isinstance(exdates, list) else [exdates]:
+            for dt in exdate.dts:
+                yield dt.dt
+
+    def _str(self, value):
+        return str(value) if value is not None else None
 
-    def _parse_events(self, ical, color):
+    def _window_events(self, calendar, color):
+        # Moved occurrences are separate VEVENTs with a RECURRENCE-ID; they
+        # replace the occurrence of the same uid the rule would create.
         events = []
         today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
-        title = ical.get('x-wr-calname', ical.get('version', ''))
-        for event in ical.walk():
-            if event.name == "VEVENT":
-                start = self._event_start(event)
-                if today <= start <= today + datetime.timedelta(days=14):
-                    events.append({
-                        'title': event.get('summary'),
-                        'calendar': title,
-                        'color': color,
-                        'start': start,
-                        'where': event.get('location'),
-                        'status': event.get('description'),
-                    })
+        moved = {(e['uid'], e['recurrence_id']) for e in calendar['events'] if e['recurrence_id']}
+        for event in calendar['events']:
+            for start in self._event_starts(event, today, moved):
+                events.append({
+                    'title': event['title'],
+                    'calendar': calendar['title'],
+                    'color': color,
+                    'start': start,
+                    'where': event['where'],
+                    'status': event['status'],
+                })
         return events
 
-    def _event_start(self, event):
-        dt = self._fix_dt(event.get('dtstart').dt)
-        recur = utils.rget(event, 'RRULE.FREQ.0')
-        if recur in TDELTAS:
-            today = datetime.datetime.combine(datetime.date.today(), datetime.time.min)
-            until = utils.rget(event, 'RRULE.UNTIL')
-            if until:
-                until = self._fix_dt(min(until))
-            while dt < today and (not until or dt < until):
-                dt += TDELTAS[recur]
-        return dt
+    def _event_starts(self, event, today, moved):
+        if not event['rrule']:
+            start = datetime.datetime.fromisoformat(event['start'])
+            return [start] if today <= start <= today + WINDOW else []
+        skip = set(event['exdates'])
+        starts = self._rule_starts(event, today)
+        return [s for s in starts if s.isoformat() not in skip and (event['uid'], s.isoformat()) not in moved]
+
+    def _rule_starts(self, event, today):
+        # Expanded once a day; the calendars are refreshed more often
+        if self.startsday != today:
+            self.starts, self.startsday = {}, today
+        key = (event['start'], event['rrule'])
+        if key not in self.starts:
+            dtstart = datetime.datetime.fromisoformat(event['start'])
+            rule = rrule.rrulestr(event['rrule'], dtstart=dtstart)
+            rule = self._jump(rule, event['rrule'], dtstart, today)
+            self.starts[key] = rule.between(today, today + WINDOW, inc=True)
+        return self.starts[key]
+
+    def _jump(self, rule, rulestr, dtstart, today):
+        # Move dtstart forward by whole periods, keeping at least one period
+        # before today, so expanding does not walk every past occurrence.
+        # Rules with COUNT or a moved day of month (ie: Jan 31) are not moved.
+        params = dict(part.split('=', 1) for part in rulestr.upper().split(';') if '=' in part)
+        if 'COUNT' in params or params.get('FREQ') not in JUMPS:
+            return rule
+        unit, size = JUMPS[params['FREQ']]
+        size *= int(params.get('INTERVAL', 1))
+        if unit == 'days':
+            elapsed = (today - dtstart).days
+        else:
+            elapsed = (today.year - dtstart.year) * 12 + today.month - dtstart.month
+        periods = max(0, elapsed // size - 1)
+        jumped = dtstart + relativedelta.relativedelta(**{unit:periods * size})
+        if unit == 'months' and jumped.day != dtstart.day:
+            return rule
+        return rule.replace(dtstart=jumped)
 
     def _fix_dt(self, dt):
         if not isinstance(dt, datetime.datetime):
@@ -109,6 +211,49 @@ class Plugin(BasePlugin):
         return url
 
 
+class EventCache(object):
+    """ Slim event records of each calendar with the ETag and Last-Modified
+        of the response they came from. Kept on disk so an unchanged calendar
+        costs a 304 and no parsing, even after a restart.
+    """
+
+    def __init__(self, dirpath=os.path.join(CACHEDIR, 'gcal')):
+        self.dirpath = dirpath      # Directory of cached calendars
+        self.calendars = {}         # Cached calendars by url
+
+    def _path(self, url):
+        return os.path.join(self.dirpath, '%s.json' % hashlib.sha1(url.encode('utf8')).hexdigest())
+
+    def get(self, url):
+        if url not in self.calendars:
+            try:
+                with open(self._path(url)) as handle:
+                    calendar = json.load(handle)
+                self.calendars[url] = calendar if calendar.get('version') == CACHE_VERSION else None
+            except (OSError, ValueError):
+                self.calendars[url] = None
+        return self.calendars[url]
+
+    def headers(self, url):
+        calendar = self.get(url) or {}
+        headers = {}
+        if calendar.get('etag'): headers['If-None-Match'] = calendar['etag']
+        if calendar.get('modified'): headers['If-Modified-Since'] = calendar['modified']
+        return headers
+
+    def set(self, url, calendar):
+        calendar['version'] = CACHE_VERSION
+        self.calendars[url] = calendar
+        try:
+            os.makedirs(self.dirpath, exist_ok=True)
+            filepath = self._path(url)
+            with open(filepath + '.tmp', 'w') as handle:
+                json.dump(calendar, handle)
+            os.replace(filepath + '.tmp', filepath)
+        except OSError as err:
+            log.warning('Unable to save calendar cache: %s', err)
+
+
 class Config(BaseConfig):
     TEMPLATE = os.path.join(SHAREDIR, 'templates', 'gcal_config.html')
     FIELDS = utils.Bunch(BaseConfig.FIELDS,
@@ -125,6 +270,7 @@ class Config(BaseConfig):
         self.colorpicker = self._init_colorpicker()
 
     def _init_colorpicker(self):
+        from PyQt5 import QtWidgets
         colorpicker = QtWidgets.QColorDialog()
         colorpicker.finished.connect(self.colorpicker_finished)
         return colorpicker
@@ -145,7 +291,7 @@ class Config(BaseConfig):
             field.help.setText(field.help_default)
             return value
         url = Plugin.build_url(value)
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if not response:
             raise ValidationError('No response from Google.')
         ical = Calendar.from_ical(response.read().decode('utf-8'))
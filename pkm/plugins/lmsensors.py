@@ -1,14 +1,21 @@
 # -*- coding: utf-8 -*-
 """
 Sensors Plugin
-
+Reads the hwmon sysfs files directly and falls back to libsensors (py3sensors)
+when there are none.
 """
-import sensors
+import glob, os, re
 from pkm import log
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
 
 NAME = 'LmSensors'
+HWMON_ROOT = '/sys/class/hwmon'
+HWMON_REGEX = re.compile(r'^(temp|fan|in|power|curr|energy|humidity)(\d+)_input$')
+HWMON_SCALES = {'temp':1000.0, 'fan':1, 'in':1000.0, 'power':1000000.0,
+    'curr':1000.0, 'energy':1000000.0, 'humidity':1000.0}
+ADAPTER_TYPES = ('acpi', 'isa')
+ADAPTER_NAMES = {'isa':'isa adapter', 'acpi':'acpi interface', 'pci':'pci adapter', 'virtual':'virtual device'}
 
 
 class Plugin(BasePlugin):
@@ -17,34 +24,160 @@ class Plugin(BasePlugin):
     @threaded_method
     def enable(self):
         try:
-            sensors.init()
+            if getattr(self, 'reader', None):
+                self.reader.close()
+            self.reader = self._init_reader()
+            self.chips = None       # Chip names the adapters were built for
+            self.adapters = {}      # Published adapter dict by chip name
             super(Plugin, self).enable()
-        except Exception:
-            log.warning('Plex server not available.')
+        except Exception as err:
+            log.warning('LmSensors plugin disabled: %s', err)
             return self.disable()
 
+    def _init_reader(self):
+        reader = HwmonReader()
+        if reader.sensors:
+            return reader
+        log.info('No hwmon sensors in %s; using libsensors.', reader.root)
+        return LibSensorsReader()
+
     @never_raise
     def update(self):
-        self.data = {}
-        for chip in sensors.iter_detected_chips():
-            chip_name = str(chip).lower()
-            adapter_name = chip.adapter_name.lower()
-            for atype in ('acpi', 'isa'):
-                if atype in chip_name + adapter_name:
-                    adapter = {}
-                    if atype not in self.data:
-                        self.data[atype] = []
-                    for feature in chip:
-                        label = self._clean_name(feature.label)
-                        value = feature.get_value()
-                        if value: adapter[label] = value
-                        if label == 'temp1': adapter['mb_temperature'] = value
-                        if label == 'temp2': adapter['cpu_temperature'] = value
-                    self.data[atype].append(adapter)
+        # Adapter dicts are built when the chips change and updated in place
+        chips = self.reader.read()
+        if [chip[0] for chip in chips] != self.chips:
+            self._init_adapters(chips)
+        for chip_name, adapter_name, features in chips:
+            adapter = self.adapters.get(chip_name)
+            if adapter is None:
+                continue
+            for label, value in features:
+                if value: adapter[label] = value
+                else: adapter.pop(label, None)
+                if label == 'temp1': adapter['mb_temperature'] = value
+                if label == 'temp2': adapter['cpu_temperature'] = value
         super(Plugin, self).update()
 
-    def _clean_name(self, name):
-        return str(name).lower().replace('+', '').replace('.', '_').strip().replace(' ', '_')
+    def _init_adapters(self, chips):
+        self.chips = [chip[0] for chip in chips]
+        self.adapters = {}
+        for atype in ADAPTER_TYPES:
+            self.data.pop(atype, None)
+        for chip_name, adapter_name, features in chips:
+            for atype in ADAPTER_TYPES:
+                if atype in chip_name + adapter_name:
+                    adapter = self.adapters.setdefault(chip_name, {})
+                    self.data.setdefault(atype, []).append(adapter)
+
+
+def clean_name(name):
+    return str(name).lower().replace('+', '').replace('.', '_').strip().replace(' ', '_')
+
+
+class HwmonReader(object):
+    """ Sensor values from /sys/class/hwmon. Chips, labels and input files are
+        found once; each input is kept open and re-read with pread. A sensor
+        that can not be read is reported as None; the chips are rediscovered
+        only when no sensor could be read (ie: a device was removed).
+    """
+
+    def __init__(self, root=HWMON_ROOT):
+        self.root = root            # Directory of hwmon devices
+        self.chips = []             # [(chip_name, adapter_name, [sensor, ...]), ...]
+        self.sensors = []           # All (fd, label, scale) tuples
+        self.discover()
+
+    def discover(self):
+        self.close()
+        for path in sorted(glob.glob(os.path.join(self.root, 'hwmon*'))):
+            name = self._read_text(os.path.join(path, 'name')) or os.path.basename(path)
+            sensors = []
+            for filename in sorted(os.listdir(path), key=self._sortkey):
+                matches = HWMON_REGEX.match(filename)
+                if not matches:
+                    continue
+                kind, index = matches.groups()
+                label = self._read_text(os.path.join(path, '%s%s_label' % (kind, index)))
+                try:
+                    fd = os.open(os.path.join(path, filename), os.O_RDONLY)
+                except OSError:
+                    continue
+                sensors.append((fd, clean_name(label or kind + index), HWMON_SCALES[kind]))
+            if sensors:
+                bus = self._bus(path)
+                self.chips.append(('%s-%s' % (name, bus), ADAPTER_NAMES[bus], sensors))
+                self.sensors += sensors
+
+    def read(self):
+        chips = [(chip, adapter, [(label, self._read_value(fd, scale)) for fd, label, scale in sensors])
+            for chip, adapter, sensors in self.chips]
+        if self.sensors and all(value is None for chip in chips for label, value in chip[2]):
+            log.info('No hwmon sensors could be read; rediscovering.')
+            self.discover()
+        return chips
+
+    def close(self):
+        for fd, label, scale in self.sensors:
+            os.close(fd)
+        self.chips, self.sensors = [], []
+
+    def _read_value(self, fd, scale):
+        # EIO and ENODATA are common for sensors that are not wired up
+        try:
+            value = int(os.pread(fd, 32, 0))
+        except (OSError, ValueError) as err:
+            log.debug('Unable to read hwmon sensor: %s', err)
+            return None
+        return value / scale if scale != 1 else value
+
+    def _read_text(self, filepath):
+        try:
+            with open(filepath) as handle:
+                return handle.read().strip()
+        except OSError:
+            return None
+
+    def _sortkey(self, filename):
+        # Keep temp2 before temp10
+        matches = HWMON_REGEX.match(filename)
+        return (matches.group(1), int(matches.group(2))) if matches else (filename, 0)
+
+    def _bus(self, path):
+        # Same bus names libsensors puts in its chip names (ie: coretemp-isa)
+        device = os.path.realpath(os.path.join(path, 'device'))
+        if not os.path.exists(os.path.join(path, 'device')):
+            return 'virtual'
+        if '/platform/' in device:
+            return 'isa'
+        if '/LNXSYSTM' in device or '/acpi/' in device:
+            return 'acpi'
+        if '/pci' in device:
+            return 'pci'
+        return 'virtual'
+
+
+class LibSensorsReader(object):
+    """ Sensor values through libsensors; used when hwmon is not available. """
+
+    def __init__(self):
+        import sensors
+        self.sensors = sensors
+        self.sensors.init()
+
+    def read(self):
+        return [(str(chip).lower(), chip.adapter_name.lower(),
+            [(clean_name(feature.label), self._read_value(feature)) for feature in chip])
+            for chip in self.sensors.iter_detected_chips()]
+
+    def _read_value(self, feature):
+        try:
+            return feature.get_value()
+        except Exception as err:
+            log.debug('Unable to read sensor %s: %s', feature.label, err)
+            return None
+
+    def close(self):
+        self.sensors.cleanup()
 
 
 class Config(BaseConfig):
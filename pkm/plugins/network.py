@@ -3,14 +3,28 @@
 Network Plugin
 Network usage and connections
 """
-import os, netifaces, psutil, time
-from pkm import utils, SHAREDIR
+import errno, math, os, netifaces, psutil, re, socket, struct, time
+from collections import Counter
+from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
+from pkm.exceptions import ValidationError
 from pkm.plugin import BasePlugin, BaseConfig
 from pkm.filters import register_filter
 
 NAME = 'Network'
 DEFAULT_IGNORES = 'lxc tun'
+DEFAULT_SMOOTHING = 3
+ADDR_POLL = 60                  # Seconds between address refreshes without netlink events
+COUNTER_WRAP = 2**32            # Counters below this are assumed to be 32bit
+RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR = 0x1, 0x10, 0x100
+RTM_EVENTS = (16, 17, 20, 21)   # RTM_NEWLINK, RTM_DELLINK, RTM_NEWADDR, RTM_DELADDR
+CONNECTIONS_INTERVAL = 5        # Seconds between reading connection stats
+NUM_REMOTES = 10                # Default number of top remote addresses
+NET_FILES = (('tcp', '/proc/net/tcp'), ('tcp', '/proc/net/tcp6'), ('udp', '/proc/net/udp'), ('udp', '/proc/net/udp6'))
+SOCKET_REGEX = re.compile(rb': ([0-9A-F]+):([0-9A-F]{4}) ([0-9A-F]+):[0-9A-F]{4} ([0-9A-F]{2}) ')
+TCP_STATES = {b'01':'established', b'02':'syn_sent', b'03':'syn_recv', b'04':'fin_wait1',
+    b'05':'fin_wait2', b'06':'time_wait', b'07':'close', b'08':'close_wait', b'09':'last_ack',
+    b'0A':'listen', b'0B':'closing', b'0C':'new_syn_recv'}
 
 
 class Plugin(BasePlugin):
@@ -19,27 +33,46 @@ class Plugin(BasePlugin):
     @threaded_method
     def enable(self):
         self.nics = {}
+        self.addrs = {}             # Cached IPv4 address info by iface
+        self.samples = {}           # (monotonic time, io) of the last update by iface, None for total
+        self.watcher = getattr(self, 'watcher', None) or AddressWatcher()
         self.ignores = self.pkmeter.config.get(self.namespace, 'ignores', '')
         self.ignores = list(filter(None, self.ignores.split(' ')))
+        self.smoothing = float(self.pkmeter.config.get(self.namespace, 'smoothing', DEFAULT_SMOOTHING))
+        self.numremotes = self.pkmeter.iter_limit('network.connections.remotes') or NUM_REMOTES
+        self.next_connections = 0
         super(Plugin, self).enable()
 
     @never_raise
     def update(self):
+        if self.watcher.changed():
+            self.addrs = {}
         for iface, newio in psutil.net_io_counters(True).items():
             if not iface.startswith('lo'):
-                netinfo = netifaces.ifaddresses(iface)
-                if netinfo.get(netifaces.AF_INET) and not self._is_ignored(iface):
+                addr = self._address(iface)
+                if addr and not self._is_ignored(iface):
                     newio = self._net_io_counters(newio)
                     newio['iface'] = iface
-                    newio.update(netinfo[netifaces.AF_INET][0])
-                    self._deltas(self.nics.get(iface,{}), newio)
-                    self.nics[iface] = newio
+                    newio.update(addr)
+                    self.nics[iface] = self._deltas(iface, newio)
                 elif iface in self.nics:
                     del self.nics[iface]
+                    del self.samples[iface]
         self.data['nics'] = sorted(self.nics.values(), key=lambda n:n['iface'])
-        self.data['total'] = self._deltas(self.data.get('total',{}), self._net_io_counters())
+        self.data['total'] = self._deltas(None, self._net_io_counters())
+        if time.monotonic() >= self.next_connections:
+            self.next_connections = time.monotonic() + CONNECTIONS_INTERVAL
+            self.data['connections'] = read_connections(numremotes=self.numremotes)
         super(Plugin, self).update()
 
+    def _address(self, iface):
+        if iface not in self.addrs:
+            try:
+                self.addrs[iface] = netifaces.ifaddresses(iface).get(netifaces.AF_INET, [None])[0]
+            except ValueError:
+                self.addrs[iface] = None
+        return self.addrs[iface]
+
     def _is_ignored(self, iface):
         if self.ignores:
             for ignore in self.ignores:
@@ -60,21 +93,156 @@ class Plugin(BasePlugin):
             'dropout': io.dropout,
         }
 
-    def _deltas(self, previo, newio):
-        now = time.time()
-        tdelta = now - previo.get('updated',0)
+    def _deltas(self, name, newio):
+        # Rates use the monotonic clock and are smoothed with an EWMA whose
+        # time constant is self.smoothing seconds (0 to disable). The time of
+        # each sample is kept in self.samples, not in the published data.
+        now = time.monotonic()
+        prevtime, previo = self.samples.get(name, (now, {}))
+        tdelta = now - prevtime
         for key in ['bytes_sent', 'bytes_recv']:
-            newio['%s_per_sec' % key] = int((newio[key] - previo.get(key,0)) / tdelta)
-        newio['updated'] = now
+            ratekey = '%s_per_sec' % key
+            if not tdelta:
+                newio[ratekey] = 0
+                continue
+            delta = newio[key] - previo[key]
+            if delta < 0:
+                # Wrapped 32bit counter if that gives a sane delta, otherwise
+                # the counter was reset (ie: interface went down)
+                wrapped = delta + COUNTER_WRAP < COUNTER_WRAP // 2 and previo[key] < COUNTER_WRAP
+                delta = delta + COUNTER_WRAP if wrapped else newio[key]
+            rate = delta / tdelta
+            if self.smoothing:
+                alpha = 1 - math.exp(-tdelta / self.smoothing)
+                rate = previo.get(ratekey, rate) + alpha * (rate - previo.get(ratekey, rate))
+            newio[ratekey] = int(rate)
+        self.samples[name] = (now, newio)
         return newio
 
 
+def read_connections(files=NET_FILES, numremotes=NUM_REMOTES):
+    """ Socket stats from the /proc/net tables: tcp counts by state, listening
+        ports and the remote addresses with the most tcp connections.
+    """
+    # Rows are matched a block at a time and counted with comprehensions
+    # rather than parsed one at a time.
+    counts, states, remotes, listening = Counter(), Counter(), Counter(), set()
+    for proto, path in files:
+        for block in _read_blocks(path):
+            rows = SOCKET_REGEX.findall(block)
+            counts[proto] += len(rows)
+            if proto == 'tcp':
+                states.update(row[3] for row in rows)
+                listening.update((proto, row[1]) for row in rows if row[3] == b'0A')
+                remotes.update(row[2] for row in rows if row[3] != b'0A')
+            else:
+                listening.update((proto, row[1]) for row in rows if row[3] == b'07' and not row[2].strip(b'0'))
+    # tcp6 rows for IPv4-mapped addresses are merged with the tcp rows
+    remoteips = Counter()
+    for addr, count in remotes.items():
+        if addr.strip(b'0'):
+            remoteips[_hex_to_ip(addr)] += count
+    return {
+        'total': sum(counts.values()),
+        'tcp': counts['tcp'],
+        'udp': counts['udp'],
+        'states': {name:states[code] for code, name in TCP_STATES.items()},
+        'listening': [{'proto':proto, 'port':port} for proto, port in sorted(set((p, int(l, 16)) for p, l in listening))],
+        'remotes': [{'addr':addr, 'count':count} for addr, count in remoteips.most_common(numremotes)],
+    }
+
+
+def _read_blocks(path, blocksize=262144):
+    # Complete lines from path in blocks of about blocksize bytes
+    try:
+        with open(path, 'rb') as handle:
+            tail = b''
+            for chunk in iter(lambda: handle.read(blocksize), b''):
+                chunk = tail + chunk
+                end = chunk.rfind(b'\n') + 1
+                tail = chunk[end:]
+                yield chunk[:end]
+            if tail:
+                yield tail
+    except FileNotFoundError:
+        pass
+
+
+def _hex_to_ip(hexaddr):
+    # Addresses are 32bit words in host byte order
+    packed = bytes.fromhex(hexaddr.decode())
+    packed = b''.join(packed[i:i+4][::-1] for i in range(0, len(packed), 4))
+    if len(packed) == 4:
+        return socket.inet_ntop(socket.AF_INET, packed)
+    if packed.startswith(b'\0' * 10 + b'\xff\xff'):
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class AddressWatcher(object):
+    """ Tells when interface addresses may have changed: on a netlink link or
+        address event, or every ADDR_POLL seconds as a fallback.
+    """
+
+    def __init__(self):
+        self.sock = self._open()
+        self.lastpoll = time.monotonic()
+
+    def _open(self):
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            sock.setblocking(False)
+            return sock
+        except (AttributeError, OSError) as err:
+            log.info('Netlink not available, polling interface addresses: %s', err)
+
+    def _msgtypes(self, data):
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msgtype = struct.unpack_from('=IH', data, offset)
+            yield msgtype
+            if not length: break
+            offset += (length + 3) & ~3
+
+    def changed(self):
+        changed = False
+        if time.monotonic() - self.lastpoll >= ADDR_POLL:
+            self.lastpoll = time.monotonic()
+            changed = True
+        while self.sock:
+            try:
+                data = self.sock.recv(65536)
+                changed = changed or any(t in RTM_EVENTS for t in self._msgtypes(data))
+            except BlockingIOError:
+                break
+            except OSError as err:
+                # ENOBUFS means events were lost; anything else closes the
+                # socket and leaves the poll as the only trigger.
+                changed = True
+                if err.errno != errno.ENOBUFS:
+                    log.info('Netlink failed, polling interface addresses: %s', err)
+                    self.sock.close()
+                    self.sock = None
+                break
+        return changed
+
+
 class Config(BaseConfig):
     TEMPLATE = os.path.join(SHAREDIR, 'templates', 'network_config.html')
     FIELDS = utils.Bunch(BaseConfig.FIELDS,
-        ignores = {'default':DEFAULT_IGNORES}
+        ignores = {'default':DEFAULT_IGNORES},
+        smoothing = {'default':DEFAULT_SMOOTHING},
     )
 
+    def validate_smoothing(self, field, value):
+        try:
+            smoothing = float(value)
+            assert 0 <= smoothing <= 60, 'Value out of bounds.'
+            return smoothing
+        except:
+            raise ValidationError('Smoothing seconds must be a number 0-60.')
+
 
 @register_filter()
 def network_friendly_iface(iface):
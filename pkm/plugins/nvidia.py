@@ -2,15 +2,23 @@
 """
 Sensors Plugin
 """
-from pkm import log, utils
+import abc, os, shlex, subprocess, threading, time
+from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
 
 NAME = 'NVIDIA'
 NVIDIA_SETTINGS = '/usr/bin/nvidia-settings'
+NVIDIA_SMI = 'nvidia-smi'
 NVIDIA_ATTRS = ('nvidiadriverversion', 'gpucoretemp', 'gpuambienttemp', 'gpucurrentfanspeedrpm',
     'gpuutilization', 'totaldedicatedgpumemory', 'useddedicatedgpumemory')
 NVIDIA_QUERY = '%s --query=%s' % (NVIDIA_SETTINGS, ' --query='.join(NVIDIA_ATTRS))
+SMI_FIELDS = (('name', 'card'), ('driver_version', 'nvidiadriverversion'), ('temperature.gpu', 'gpucoretemp'),
+    ('fan.speed', 'gpucurrentfanspeedrpm'), ('utilization.gpu', 'gpuutilization_graphics'),
+    ('utilization.memory', 'gpuutilization_memory'), ('memory.total', 'totaldedicatedgpumemory'),
+    ('memory.used', 'useddedicatedgpumemory'))
+DEFAULT_PROVIDER = 'auto'
+MAX_RESTART_DELAY = 300     # Max seconds between nvidia-smi restarts
 
 
 class Plugin(BasePlugin):
@@ -18,28 +26,180 @@ class Plugin(BasePlugin):
 
     @threaded_method
     def enable(self):
+        # The provider may start a process; only create it once the plugin
+        # is enabled in preferences and used by the layout.
+        self._close_provider()
+        if not super(Plugin, self).enable():
+            return False
         try:
-            self.card_name = self._fetch_card_name()
-            result = utils.get_stdout('%s --version' % NVIDIA_SETTINGS)
-            assert 'NVIDIA' in result, 'nvidia-settings not found.'
-            super(Plugin, self).enable()
+            self.attrs = set()
+            self.provider = self._init_provider()
+            log.info('NVIDIA plugin using %s.', self.provider.NAME)
         except Exception as err:
             log.warning('NVIDIA plugin disabled: %s', err)
             return self.disable()
 
+    def disable(self):
+        self._close_provider()
+        return super(Plugin, self).disable()
+
+    def _close_provider(self):
+        provider, self.provider = getattr(self, 'provider', None), None
+        if provider:
+            provider.close()
+
+    def _init_provider(self):
+        name = self.pkmeter.config.get(self.namespace, 'provider', DEFAULT_PROVIDER)
+        if name.startswith('fake:'):
+            return FakeProvider(name[5:])
+        providers = {'nvml':NVMLProvider, 'nvidia-smi':SMIProvider, 'nvidia-settings':SettingsProvider}
+        if name != 'auto':
+            return providers[name](self.interval)
+        errors = []
+        for provider in (NVMLProvider, SMIProvider, SettingsProvider):
+            try:
+                return provider(self.interval)
+            except Exception as err:
+                errors.append('%s: %s' % (provider.NAME, err))
+        raise Exception('No provider available (%s)' % '; '.join(errors))
+
     @never_raise
     def update(self):
-        self.data['card'] = self.card_name or 'Unknown'
-        output = utils.get_stdout(NVIDIA_QUERY)
-        for attr, value in self._parse_attributes(output):
-            self.data[attr] = value
+        if not self.provider:
+            return  # Still starting
+        values = self.provider.sample()
+        for attr in self.attrs.difference(values):
+            self.data.pop(attr, None)  # No longer reported
+        self.attrs = set(values)
+        self.data.update(values)
+        self.data['card'] = self.data.get('card') or 'Unknown'
         # Calculate used and percent memory
-        mem_total = utils.to_int(self.data['totaldedicatedgpumemory'], 0)
-        mem_used = utils.to_int(self.data['useddedicatedgpumemory'], 0)
+        mem_total = utils.to_int(self.data.get('totaldedicatedgpumemory'), 0)
+        mem_used = utils.to_int(self.data.get('useddedicatedgpumemory'), 0)
         self.data['freededicatedgpumemory'] = mem_total - mem_used
         self.data['percentuseddedicatedgpumemory'] = utils.percent(mem_used, mem_total, 0)
         super(Plugin, self).update()
 
+
+class Provider(object, metaclass=abc.ABCMeta):
+    """ Source of GPU attributes for the first card. sample() returns a dict
+        using the nvidia-settings attribute names, memory in MB.
+    """
+    NAME = None
+
+    @abc.abstractmethod
+    def sample(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NVMLProvider(Provider):
+    """ NVML through the optional pynvml binding; no processes involved. """
+    NAME = 'nvml'
+
+    def __init__(self, interval=None):
+        import pynvml
+        self.nvml = pynvml
+        self.nvml.nvmlInit()
+        self.handle = self.nvml.nvmlDeviceGetHandleByIndex(0)
+        self.static = {
+            'card': self._str(self.nvml.nvmlDeviceGetName(self.handle)),
+            'nvidiadriverversion': self._str(self.nvml.nvmlSystemGetDriverVersion()),
+        }
+
+    def _str(self, value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def sample(self):
+        nvml, handle = self.nvml, self.handle
+        util = nvml.nvmlDeviceGetUtilizationRates(handle)
+        memory = nvml.nvmlDeviceGetMemoryInfo(handle)
+        values = dict(self.static)
+        values['gpucoretemp'] = nvml.nvmlDeviceGetTemperature(handle, nvml.NVML_TEMPERATURE_GPU)
+        values['gpuutilization_graphics'] = util.gpu
+        values['gpuutilization_memory'] = util.memory
+        values['totaldedicatedgpumemory'] = memory.total // 1048576
+        values['useddedicatedgpumemory'] = memory.used // 1048576
+        try:
+            values['gpucurrentfanspeedrpm'] = nvml.nvmlDeviceGetFanSpeed(handle)
+        except nvml.NVMLError:
+            pass  # Passively cooled
+        return values
+
+    def close(self):
+        self.nvml.nvmlShutdown()
+
+
+class SMIProvider(Provider):
+    """ A long running nvidia-smi --loop-ms child; its csv output is read in a
+        thread and sample() returns the latest line. If it exits it is
+        restarted, waiting twice as long each time it exits again without
+        reporting a line.
+    """
+    NAME = 'nvidia-smi'
+
+    def __init__(self, interval):
+        self.interval = interval            # Seconds between samples
+        self.latest = {}                    # Latest parsed line
+        self.ready = threading.Event()      # Set once the first line is read
+        self.proc = None                    # Running nvidia-smi process
+        self.restarts = 0                   # Restarts without a line read
+        self.restart_at = 0                 # Time of the next allowed restart
+        self._start()
+        if not self.ready.wait(5) and self.proc.poll() is not None:
+            raise Exception('nvidia-smi exited with status %s' % self.proc.returncode)
+
+    def _start(self):
+        fields = ','.join(field for field, attr in SMI_FIELDS)
+        cmd = '%s --id=0 --query-gpu=%s --format=csv,noheader,nounits --loop-ms=%d' % (
+            NVIDIA_SMI, fields, self.interval * 1000)
+        log.debug('Running command: %s' % cmd)
+        self.proc = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, universal_newlines=True, bufsize=1)
+        thread = threading.Thread(target=self._read, args=[self.proc])
+        thread.daemon = True
+        thread.start()
+
+    def _read(self, proc):
+        for line in proc.stdout:
+            values = parse_smi_line(line)
+            if values:
+                self.latest = values
+                self.restarts = 0
+                self.ready.set()
+
+    def sample(self):
+        if self.proc.poll() is None:
+            return self.latest
+        if time.time() >= self.restart_at:
+            delay = min(MAX_RESTART_DELAY, self.interval * 2 ** min(self.restarts, 16))
+            log.warning('nvidia-smi exited with status %s; restarting.', self.proc.returncode)
+            self.restarts += 1
+            self.restart_at = time.time() + delay
+            self._start()
+        return {}
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+
+
+class SettingsProvider(Provider):
+    """ Runs nvidia-settings for every sample; the original fallback. """
+    NAME = 'nvidia-settings'
+
+    def __init__(self, interval=None):
+        result = utils.get_stdout('%s --version' % NVIDIA_SETTINGS)
+        assert 'NVIDIA' in result, 'nvidia-settings not found.'
+        self.card_name = self._fetch_card_name()
+
+    def sample(self):
+        values = dict(self._parse_attributes(utils.get_stdout(NVIDIA_QUERY)))
+        values['card'] = self.card_name
+        return values
+
     def _parse_attributes(self, output):
         for line in output.split('\n'):
             line = line.lower().strip(' .').replace("'", '')
@@ -56,7 +216,7 @@ class Plugin(BasePlugin):
     def _parse_multivalue_attribute(self, value):
         for subpart in value.strip(' ,').split(','):
             subkey, subvalue = subpart.split('=')
-            yield subkey, int(subvalue)
+            yield subkey.strip(), int(subvalue)
 
     @never_raise
     def _fetch_card_name(self):
@@ -65,5 +225,38 @@ class Plugin(BasePlugin):
                 return line.split(':', 1)[1].split('/')[0].strip()
 
 
+class FakeProvider(Provider):
+    """ Replays nvidia-smi csv lines from a fixture file, one per sample, to
+        exercise parsing and scheduling without a GPU.
+    """
+    NAME = 'fake'
+
+    def __init__(self, path, interval=None):
+        with open(path) as handle:
+            self.lines = [line for line in handle if line.strip()]
+        assert self.lines, 'No lines in fixture %s' % path
+        self.index = 0
+
+    def sample(self):
+        line = self.lines[self.index % len(self.lines)]
+        self.index += 1
+        return parse_smi_line(line)
+
+
+def parse_smi_line(line):
+    values = [v.strip() for v in line.split(',')]
+    if len(values) != len(SMI_FIELDS):
+        return None
+    result = {}
+    for (field, attr), value in zip(SMI_FIELDS, values):
+        if value in ('[Not Supported]', '[N/A]', 'N/A', ''):
+            continue
+        result[attr] = value if attr in ('card', 'nvidiadriverversion') else utils.to_int(value.split('.')[0], value)
+    return result
+
+
 class Config(BaseConfig):
-    pass
+    TEMPLATE = os.path.join(SHAREDIR, 'templates', 'nvidia_config.html')
+    FIELDS = utils.Bunch(BaseConfig.FIELDS,
+        provider = {'default':DEFAULT_PROVIDER}
+    )
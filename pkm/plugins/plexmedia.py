@@ -9,7 +9,7 @@ from plexapi.video import Season
 from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
-from pkm.plugins.plexserver import fetch_plex_instance
+from pkm.plex import get_plex, plex_query
 
 NAME = 'Plex Media'
 UPDATE_URL = '%(plexhost)s/library/recentlyAdded'
@@ -21,9 +21,9 @@ class Plugin(BasePlugin):
     @threaded_method
     def enable(self):
         try:
-            self.plex = fetch_plex_instance(self.pkmeter)
-            self.ignores = self.pkmeter.config.get(self.namespace, 'ignores', '')
-            self.ignores = list(filter(None, self.ignores.split('\n')))
+            get_plex(self.pkmeter)  # Connect now to find out if the server is there
+            self.ignores = utils.ignore_matcher(self.pkmeter.config.get(self.namespace, 'ignores', ''))
+            self.seasons = {}   # Season titles by (ratingKey, addedAt, leafCount)
             super(Plugin, self).enable()
         except NotFound:
             log.warning('Plex server not available.')
@@ -32,11 +32,11 @@ class Plugin(BasePlugin):
     @never_raise
     def update(self):
         self.data['videos'] = []
-        videos = self.plex.library.recentlyAdded()
+        videos = plex_query(self.pkmeter, lambda plex: plex.library.recentlyAdded())
         videos = sorted(videos, key=lambda v:v.addedAt, reverse=True)
         for video in videos[:10]:
             title = self._video_title(video)
-            if self._is_ignored(title):
+            if self.ignores(title):
                 continue
             self.data['videos'].append({
                 'title': title,
@@ -48,16 +48,20 @@ class Plugin(BasePlugin):
 
     def _video_title(self, video):
         if video.type == Season.TYPE:
-            episode = video.episodes()[-1]
-            return '%s s%se%s' % (episode.grandparentTitle, episode.parentIndex, video.leafCount)
+            return self._season_title(video)
         return '%s (%s)' % (video.title, video.year)
 
-    def _is_ignored(self, title):
-        if self.ignores:
-            for ignore in self.ignores:
-                if ignore.lower() in title.lower():
-                    return True
-        return False
+    def _season_title(self, season):
+        # The recentlyAdded entry has the show title and season number; only
+        # fall back to listing the episodes if it does not, and remember the
+        # result until the season changes.
+        if season.parentTitle and season.index is not None:
+            return '%s s%se%s' % (season.parentTitle, season.index, season.leafCount)
+        key = (season.ratingKey, season.addedAt, season.leafCount)
+        if key not in self.seasons:
+            episode = season.episodes()[-1]
+            self.seasons[key] = '%s s%se%s' % (episode.grandparentTitle, episode.parentIndex, season.leafCount)
+        return self.seasons[key]
 
 
 class Config(BaseConfig):
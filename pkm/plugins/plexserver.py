@@ -4,12 +4,11 @@ Plex Server
 Who is watching what?
 """
 import os
-from plexapi.server import PlexServer
 from plexapi.exceptions import NotFound, Unauthorized
-from plexapi.myplex import MyPlexAccount
 from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.exceptions import ValidationError
+from pkm.plex import get_plex, plex_query, signin
 from pkm.plugin import BasePlugin, BaseConfig
 from pkm.filters import register_filter
 from plexapi.video import Episode
@@ -23,7 +22,7 @@ class Plugin(BasePlugin):
     @threaded_method
     def enable(self):
         try:
-            self.plex = fetch_plex_instance(self.pkmeter)
+            get_plex(self.pkmeter)  # Connect now to find out if the server is there
             super(Plugin, self).enable()
         except NotFound:
             log.warning('Plex server not available.')
@@ -31,9 +30,9 @@ class Plugin(BasePlugin):
 
     @never_raise
     def update(self):
-        self.data.update(plex_dict(self.plex))
+        self.data.update(plex_query(self.pkmeter, plex_dict))
         self.data['videos'] = []
-        for video in self.plex.sessions():
+        for video in plex_query(self.pkmeter, lambda plex: plex.sessions()):
             vinfo = {
                 'user': video.usernames[0],
                 'type': video.type,
@@ -50,9 +49,6 @@ class Plugin(BasePlugin):
                 self.data['videos'].append(vinfo)
         super(Plugin, self).update()
 
-    def _plex_address(self):
-        return 'http://%s:%s' % (self.plex.address, self.plex.port)
-
     def _video_title(self, video):
         if video.type == Episode.TYPE:
             return '%s s%se%s' % (video.grandparentTitle, video.seasonNumber, video.index)
@@ -68,7 +64,7 @@ class Config(BaseConfig):
         if not value:
             return value
         try:
-            MyPlexAccount.signin(self.fields.username.value, value)
+            signin(self.fields.username.value, value, cached=False)
             return value
         except Unauthorized:
             raise ValidationError('Invalid username or password.')
@@ -79,7 +75,9 @@ class Config(BaseConfig):
         try:
             username = self.fields.username.value
             password = self.fields.password.value
-            fetch_plex_instance(self.pkmeter, username, password, value)
+            # A new connection checks the password just entered; the shared
+            # one is only replaced if it works.
+            get_plex(self.pkmeter, username, password, value, reconnect=True)
             return value
         except Unauthorized:
             raise ValidationError('Invalid username or password.')
@@ -89,18 +87,6 @@ class Config(BaseConfig):
             raise ValidationError('Invalid server.')
 
 
-def fetch_plex_instance(pkmeter, username=None, password=None, host=None):
-    username = username or pkmeter.config.get('plexserver', 'username', from_keyring=True)
-    password = password or pkmeter.config.get('plexserver', 'password', from_keyring=True)
-    host = host or pkmeter.config.get('plexserver', 'host', '')
-    if username:
-        log.info('Logging into MyPlex with user %s', username)
-        user = MyPlexAccount.signin(username, password)
-        return user.resource(host).connect()
-    log.info('Connecting to Plex host: %s', host)
-    return PlexServer(host)
-
-
 def plex_dict(plex):
     data = {}
     data['baseurl'] = plex._baseurl
@@ -3,13 +3,16 @@
 Processes Plugin
 List Top Processes
 """
-import psutil, shlex
-from pkm import log
+import heapq, os, psutil, pwd, shlex
+from collections import deque
+from pkm import log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
+from pkm.exceptions import ValidationError
 from pkm.plugin import BasePlugin, BaseConfig
 from subprocess import Popen, DEVNULL
 
 NAME = 'Processes'
+DEFAULT_BUDGET = 50
 
 
 class Plugin(BasePlugin):
@@ -19,37 +22,167 @@ class Plugin(BasePlugin):
     def enable(self):
         self.procs = {}
         self.sortkey = 'cpu_percent'
+        self.limits = {p:self.pkmeter.iter_limit(p) for p in ('processes.procs', 'processes.users', 'processes.trees')}
+        self.budget = int(self.pkmeter.config.get(self.namespace, 'budget', DEFAULT_BUDGET))
+        self.users = {}             # Totals by username
+        self.trees = {}             # Totals by process tree (top ancestor pid)
+        self.usernames = {}         # Cached uid -> username
+        self.rotation = deque()     # Pids waiting for secondary attributes
         super(Plugin, self).enable()
 
     @never_raise
     def update(self):
         pids = set()
-        for pid in list(psutil.pids()):
+        for pid in psutil.pids():
             try:
-                proc = self.procs.get(pid, {}).get('proc')
+                proc = self.procs.get(pid)
                 if not proc:
-                    proc = psutil.Process(pid)
-                    self.procs[pid] = {
-                        'proc': proc,
-                        'pid': pid,
-                        'cmdline': proc.cmdline(),
-                        'create_time': proc.create_time(),
-                        'name': proc.name(),
-                        'username': proc.username(),
-                    }
-                self.procs[pid]['cpu_percent'] = proc.cpu_percent()
-                self.procs[pid]['memory_rss'] = proc.memory_info().rss
-                self.procs[pid]['status'] = proc.status()
+                    proc = self.procs[pid] = self._new_proc(pid)
+                self._sample_proc(proc)
                 pids.add(pid)
             except (psutil.NoSuchProcess, psutil.AccessDenied):
                 pass
         for pid in [p for p in self.procs if p not in pids]:
-            del self.procs[pid]
+            self._remove_proc(pid)
+        self._update_trees()
+        self._sample_secondary()
         self.data['sort'] = self.sortkey
         self.data['total'] = len(self.procs)
-        self.data['procs'] = sorted(self.procs.values(), key=lambda p: p[self.sortkey], reverse=True)
+        self.data['procs'] = self._top_procs()
+        self.data['users'] = self._top(self.users.values(), 'processes.users')
+        self.data['trees'] = self._top(self.trees.values(), 'processes.trees')
         super(Plugin, self).update()
 
+    def _new_proc(self, pid):
+        # Name, user and parent come from the stat and status files, read
+        # once in oneshot. The process starts in a tree of its own until
+        # _update_trees() finds its top ancestor.
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            info = {
+                'proc': proc,
+                'pid': pid,
+                'ppid': proc.ppid(),
+                'create_time': proc.create_time(),
+                'name': proc.name(),
+                'username': self._username(proc.uids().real),
+                'cpu_percent': 0.0,
+                'memory_rss': 0,
+                'tree': pid,
+            }
+        self._join_totals(info, 1)
+        return info
+
+    def _remove_proc(self, pid):
+        self._join_totals(self.procs.pop(pid), -1)
+
+    def _join_totals(self, proc, sign):
+        # Add (sign=1) or remove (sign=-1) proc from its user and tree totals
+        if proc['username'] not in self.users:
+            self.users[proc['username']] = {'username':proc['username'], 'count':0, 'cpu_percent':0.0, 'memory_rss':0}
+        if proc['tree'] not in self.trees:
+            root = self.procs.get(proc['tree'], proc)
+            self.trees[proc['tree']] = {'pid':proc['tree'], 'name':root['name'], 'count':0, 'cpu_percent':0.0, 'memory_rss':0}
+        for totals, key in ((self.users, proc['username']), (self.trees, proc['tree'])):
+            totals[key]['count'] += sign
+            if not totals[key]['count']:
+                del totals[key]
+                continue
+            totals[key]['cpu_percent'] = round(totals[key]['cpu_percent'] + sign * proc['cpu_percent'], 2)
+            totals[key]['memory_rss'] += sign * proc['memory_rss']
+
+    def _update_trees(self):
+        # Processes can be reparented (ie: when their parent exits), so the
+        # top ancestor of each one is found again on every update.
+        roots = {}
+        for proc in self.procs.values():
+            root = self._tree_root(proc['pid'], roots)
+            if root != proc['tree']:
+                self._join_totals(proc, -1)
+                proc['tree'] = root
+                self._join_totals(proc, 1)
+
+    def _tree_root(self, pid, roots):
+        # Follow ppid up to the ancestor just below init (or the first one
+        # whose parent is not known); roots caches the answer for the path.
+        path = []
+        while pid not in roots:
+            path.append(pid)
+            ppid = self.procs[pid]['ppid']
+            if ppid in (0, 1) or ppid not in self.procs or ppid in path:
+                roots[pid] = pid
+                break
+            pid = ppid
+        for p in path:
+            roots[p] = roots[pid]
+        return roots[pid]
+
+    def _totals(self, proc):
+        return self.users[proc['username']], self.trees[proc['tree']]
+
+    def _add_to_totals(self, proc, cpu_percent, memory_rss):
+        for totals in self._totals(proc):
+            totals['cpu_percent'] = round(totals['cpu_percent'] + cpu_percent, 2)
+            totals['memory_rss'] += memory_rss
+
+    def _sample_proc(self, proc):
+        # Cheap attributes; stat and status are read once in oneshot
+        with proc['proc'].oneshot():
+            cpu_percent = proc['proc'].cpu_percent()
+            memory_rss = proc['proc'].memory_info().rss
+            proc['status'] = proc['proc'].status()
+            proc['ppid'] = proc['proc'].ppid()
+        self._add_to_totals(proc, cpu_percent - proc['cpu_percent'], memory_rss - proc['memory_rss'])
+        proc['cpu_percent'] = cpu_percent
+        proc['memory_rss'] = memory_rss
+
+    def _sample_details(self, proc):
+        # Expensive attributes; only read once a process is shown
+        try:
+            proc['cmdline'] = proc['proc'].cmdline()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            proc['cmdline'] = []
+
+    def _sample_secondary(self):
+        # Read io counters and thread counts for up to budget processes,
+        # continuing through the process table on the next update.
+        for i in range(min(self.budget, len(self.procs))):
+            if not self.rotation:
+                self.rotation.extend(self.procs)
+            proc = self.procs.get(self.rotation.popleft())
+            if not proc:
+                continue
+            try:
+                proc['num_threads'] = proc['proc'].num_threads()
+                io = proc['proc'].io_counters()
+                proc['io_read_bytes'] = io.read_bytes
+                proc['io_write_bytes'] = io.write_bytes
+            except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+                pass
+
+    def _top(self, rows, varpath):
+        # Only the rows shown in the layout are selected and published
+        key = lambda r: r[self.sortkey]
+        limit = self.limits.get(varpath)
+        if limit:
+            return heapq.nlargest(limit, rows, key=key)
+        return sorted(rows, key=key, reverse=True)
+
+    def _top_procs(self):
+        procs = self._top(self.procs.values(), 'processes.procs')
+        for proc in procs:
+            if 'cmdline' not in proc:
+                self._sample_details(proc)
+        return procs
+
+    def _username(self, uid):
+        if uid not in self.usernames:
+            try:
+                self.usernames[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self.usernames[uid] = str(uid)
+        return self.usernames[uid]
+
     def sort_cpu(self):
         self.sortkey = 'cpu_percent'
         self.update()
@@ -66,4 +199,15 @@ class Plugin(BasePlugin):
 
 
 class Config(BaseConfig):
-    pass
+    TEMPLATE = os.path.join(SHAREDIR, 'templates', 'processes_config.html')
+    FIELDS = utils.Bunch(BaseConfig.FIELDS,
+        budget = {'default':DEFAULT_BUDGET}
+    )
+
+    def validate_budget(self, field, value):
+        try:
+            budget = int(value)
+            assert 0 <= budget <= 10000, 'Value out of bounds.'
+            return budget
+        except:
+            raise ValidationError('Budget must be a number 0-10000.')
@@ -5,7 +5,7 @@ Coming Soon
 """
 import json, os, webbrowser
 from datetime import datetime
-from pkm import log, utils, SHAREDIR
+from pkm import httpclient, log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.exceptions import ValidationError
 from pkm.plugin import BasePlugin, BaseConfig
@@ -31,22 +31,22 @@ class Plugin(BasePlugin):
             log.warning('Sickbeard apikey not specified.')
             return self.disable()
         self.update_url = UPDATE_URL % {'host':self.host, 'apikey':apikey}
-        self.ignores = self.pkmeter.config.get('plexmedia', 'ignores', '')
-        self.ignores = list(filter(None, self.ignores.split('\n')))
+        self.ignores = utils.ignore_matcher(self.pkmeter.config.get('plexmedia', 'ignores', ''))
         super(Plugin, self).enable()
 
     @never_raise
     def update(self):
-        response = utils.http_request(self.update_url).get('response')
+        response = httpclient.request(self.update_url).get('response')
+        if not response:
+            return self.failure()
         shows = []
-        if response:
-            content = json.loads(response.read().decode('utf-8'))
-            for stype in ('missed','today','soon','later'):
-                for show in utils.rget(content, 'data.%s' % stype, []):
-                    show['datestr'] = self._datestr(stype, show)
-                    show['episode'] = "s%se%s" % (show.get('season',''), show.get('episode',''))
-                    if not self._is_ignored(show):
-                        shows.append(show)
+        content = json.loads(response.read().decode('utf-8'))
+        for stype in ('missed','today','soon','later'):
+            for show in utils.rget(content, 'data.%s' % stype, []):
+                show['datestr'] = self._datestr(stype, show)
+                show['episode'] = "s%se%s" % (show.get('season',''), show.get('episode',''))
+                if not self.ignores(show['show_name']):
+                    shows.append(show)
         self.data['shows'] = shows
         super(Plugin, self).update()
 
@@ -58,13 +58,6 @@ class Plugin(BasePlugin):
         airtime = airtime.replace(' AM','a').replace(' PM','p')
         return 'Today %s' % airtime if stype == 'today' else '%s %s' % (airday, airtime)
 
-    def _is_ignored(self, show):
-        if self.ignores:
-            for ignore in self.ignores:
-                if ignore.lower() in show['show_name'].lower():
-                    return True
-        return False
-
     @never_raise
     def open_sickbeard(self, widget):
         log.info('Opening Sickbeard: %s', self.host)
@@ -79,7 +72,7 @@ class Config(BaseConfig):
         if not value:
             return value
         url = PING_URL % {'host':value, 'apikey':1234}
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if not response:
             raise ValidationError('Host not reachable.')
         if response.status != 200:
@@ -93,7 +86,7 @@ class Config(BaseConfig):
         if host is None:
             host = self.pkconfig.get(self.namespace, 'host')
         url = PING_URL % {'host':host, 'apikey':value}
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if not response:
             raise ValidationError('Host not reachable.')
         if response.status != 200:
@@ -5,7 +5,7 @@ Coming Soon
 """
 import json, os, webbrowser
 from datetime import datetime, timedelta
-from pkm import log, utils, SHAREDIR
+from pkm import httpclient, log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.exceptions import ValidationError
 from pkm.filters import register_filter
@@ -29,27 +29,20 @@ class Plugin(BasePlugin):
         if not self.apikey:
             log.warning('Sonarr apikey not specified.')
             return self.disable()
-        self.ignores = self.pkmeter.config.get('plexmedia', 'ignores', '')
-        self.ignores = list(filter(None, self.ignores.split('\n')))
+        self.ignores = utils.ignore_matcher(self.pkmeter.config.get('plexmedia', 'ignores', ''))
         super(Plugin, self).enable()
 
     @never_raise
     def update(self):
         endstr = (datetime.now() + timedelta(days=14)).strftime(DATE_FORMAT)
         update_url = UPDATE_URL % {'host':self.host, 'apikey':self.apikey, 'end':endstr}
-        response = utils.http_request(update_url).get('response')
-        if response:
-            content = json.loads(response.read().decode('utf-8'))
-            self.data['shows'] = [e for e in content if not self._is_ignored(utils.rget(e, 'series.title'))]
+        response = httpclient.request(update_url).get('response')
+        if not response:
+            return self.failure()
+        content = json.loads(response.read().decode('utf-8'))
+        self.data['shows'] = [e for e in content if not self.ignores(utils.rget(e, 'series.title'))]
         super(Plugin, self).update()
 
-    def _is_ignored(self, title):
-        if self.ignores:
-            for ignore in self.ignores:
-                if ignore.lower() in title.lower():
-                    return True
-        return False
-
     @never_raise
     def open_sonarr(self, widget):
         log.info('Opening Sonarr: %s', self.host)
@@ -64,7 +57,7 @@ class Config(BaseConfig):
         if not value:
             return value
         url = UPDATE_URL % {'host':value, 'apikey':1234, 'end':'2000-01-01'}
-        response = utils.http_request(url, timeout=2)
+        response = httpclient.request(url, timeout=2)
         if utils.rget(response, 'error.code') != 401:
             raise ValidationError('Host not reachable.')
         return value
@@ -76,7 +69,7 @@ class Config(BaseConfig):
         if host is None:
             host = self.pkconfig.get(self.namespace, 'host')
         url = UPDATE_URL % {'host':host, 'apikey':value, 'end':'2000-01-01'}
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if utils.rget(response, 'error.code') == 401:
             raise ValidationError('Invalid API key specified.')
         content = json.loads(response.read().decode('utf-8'))
@@ -3,13 +3,14 @@
 System Plugin
 General System and Memory usage
 """
-import psutil, socket, shlex, time
+import os, psutil, socket, shlex, time
 from pkm import log
 from pkm.decorators import never_raise, threaded_method
 from pkm.plugin import BasePlugin, BaseConfig
 from subprocess import Popen, DEVNULL
 
 NAME = 'System'
+PAGESIZE = os.sysconf('SC_PAGE_SIZE')
 
 
 class Plugin(BasePlugin):
@@ -17,6 +18,7 @@ class Plugin(BasePlugin):
 
     @threaded_method
     def enable(self):
+        self.sampler = ProcSampler() if ProcSampler.available() else None
         self.data['cpu_count'] = psutil.cpu_count()
         self.data['hostname'] = socket.gethostname()
         self.data['boot_time'] = psutil.boot_time()
@@ -24,10 +26,13 @@ class Plugin(BasePlugin):
 
     @never_raise
     def update(self):
-        self.data['cpu_percent'] = psutil.cpu_percent()
-        self.data['cpu_percents'] = psutil.cpu_percent(percpu=True)
-        self.data['memory'] = self._virtual_memory()
-        self.data['swap'] = self._swap_memory()
+        if self.sampler:
+            self.sampler.sample(self.data)
+        else:
+            self.data['cpu_percents'] = psutil.cpu_percent(percpu=True)
+            self.data['cpu_percent'] = round(sum(self.data['cpu_percents']) / len(self.data['cpu_percents']), 1)
+            self.data['memory'] = self._virtual_memory()
+            self.data['swap'] = self._swap_memory()
         self.data['uptime'] = int(time.time() - self.data['boot_time'])
         super(Plugin, self).update()
 
@@ -64,5 +69,102 @@ class Plugin(BasePlugin):
         Popen(shlex.split(cmd), stdout=DEVNULL, stderr=DEVNULL)
 
 
+class ProcSampler(object):
+    """ Reads /proc/stat, /proc/meminfo and /proc/vmstat once per update into
+        reused buffers. Total and per-core cpu, memory and swap all come from
+        that one sample; values match what psutil reports on Linux.
+    """
+    PATHS = ('/proc/stat', '/proc/meminfo', '/proc/vmstat')
+
+    def __init__(self):
+        self.files = [open(path, 'rb', buffering=0) for path in self.PATHS]
+        self.buffers = [bytearray(8192) for path in self.PATHS]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self.cputimes = None                    # Previous (busy, total) per cpu; first is the total
+        self.meminfo = {}                       # Last values read from /proc/meminfo
+        self.memory = {}                        # Reused memory dict
+        self.swap = {}                          # Reused swap dict
+
+    @classmethod
+    def available(cls):
+        return all(os.access(path, os.R_OK) for path in cls.PATHS)
+
+    def _read(self, i):
+        # Grow the buffer if the file no longer fits (ie: many cores)
+        while True:
+            self.files[i].seek(0)
+            size = self.files[i].readinto(self.buffers[i])
+            if size < len(self.buffers[i]):
+                return self.views[i][:size]
+            self.buffers[i] = bytearray(len(self.buffers[i]) * 2)
+            self.views[i] = memoryview(self.buffers[i])
+
+    def _fields(self, view, names):
+        values = {}
+        for line in bytes(view).split(b'\n'):
+            name, _, value = line.partition(b' ')
+            name = name.rstrip(b':')
+            if name in names:
+                values[name] = int(value.split()[0])
+                if len(values) == len(names):
+                    break
+        return values
+
+    def sample(self, data):
+        data['cpu_percent'], data['cpu_percents'] = self._cpu()
+        data['memory'] = self._memory()
+        data['swap'] = self._swap()
+
+    def _cpu(self):
+        cputimes = []
+        for line in bytes(self._read(0)).split(b'\n'):
+            if not line.startswith(b'cpu'):
+                break
+            # user nice system idle iowait irq softirq steal (guest is part of user)
+            times = [int(x) for x in line.split()[1:9]]
+            total = sum(times)
+            cputimes.append((total - times[3] - times[4], total))
+        prevtimes, self.cputimes = self.cputimes or cputimes, cputimes
+        percents = []
+        for (busy, total), (prevbusy, prevtotal) in zip(cputimes, prevtimes):
+            dtotal = total - prevtotal
+            percents.append(round(max(0, busy - prevbusy) / dtotal * 100, 1) if dtotal > 0 else 0.0)
+        return percents[0], percents[1:]
+
+    def _memory(self):
+        names = (b'MemTotal', b'MemFree', b'MemAvailable', b'Buffers', b'Cached', b'SReclaimable', b'Active', b'Inactive',
+            b'SwapTotal', b'SwapFree')
+        self.meminfo = {k:v * 1024 for k, v in self._fields(self._read(1), names).items()}
+        total = self.meminfo[b'MemTotal']
+        available = self.meminfo.get(b'MemAvailable', self.meminfo[b'MemFree'])
+        cached = self.meminfo[b'Cached'] + self.meminfo.get(b'SReclaimable', 0)
+        self.memory.update({
+            'total': total,
+            'available': available,
+            'percent': round((total - available) / total * 100, 1),
+            'used': total - available,
+            'free': self.meminfo[b'MemFree'],
+            'active': self.meminfo[b'Active'],
+            'inactive': self.meminfo[b'Inactive'],
+            'buffers': self.meminfo[b'Buffers'],
+            'cached': cached,
+            'cached_percent': round((cached / total) * 100, 1)
+        })
+        return self.memory
+
+    def _swap(self):
+        vmstat = self._fields(self._read(2), (b'pswpin', b'pswpout'))
+        total, free = self.meminfo[b'SwapTotal'], self.meminfo[b'SwapFree']
+        self.swap.update({
+            'total': total,
+            'used': total - free,
+            'free': free,
+            'percent': round((total - free) / total * 100, 1) if total else 0.0,
+            'sin': vmstat.get(b'pswpin', 0) * PAGESIZE,
+            'sout': vmstat.get(b'pswpout', 0) * PAGESIZE,
+        })
+        return self.swap
+
+
 class Config(BaseConfig):
     pass
@@ -4,7 +4,7 @@ Weather Underground
 Fetch current weather from api.wunderground.com
 """
 import json, os, webbrowser
-from pkm import SHAREDIR, log, utils
+from pkm import httpclient, log, utils, SHAREDIR
 from pkm.decorators import never_raise, threaded_method
 from pkm.exceptions import ValidationError
 from pkm.plugin import BasePlugin, BaseConfig
@@ -53,9 +53,10 @@ class Plugin(BasePlugin):
 
     @never_raise
     def update(self):
-        response = utils.http_request(self.update_url).get('response')
-        if response:
-            self.data = json.loads(response.read().decode('utf-8'))
+        response = httpclient.request(self.update_url).get('response')
+        if not response:
+            return self.failure()
+        self.data = json.loads(response.read().decode('utf-8'))
         super(Plugin, self).update()
 
     @never_raise
@@ -76,7 +77,7 @@ class Config(BaseConfig):
         if not value:
             return value
         url = UPDATE_URL % {'apikey':value, 'location':'autoip'}
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if not response:
             raise ValidationError('No response from Weather Underground.')
         content = json.loads(response.read().decode('utf-8'))
@@ -92,7 +93,7 @@ class Config(BaseConfig):
             field.help.setText(field.help_default)
             return value
         url = QUERY_URL % {'query':value}
-        response = utils.http_request(url, timeout=2).get('response')
+        response = httpclient.request(url, timeout=2).get('response')
         if not response:
             raise ValidationError('No response from Weather Underground.')
         content = json.loads(response.read().decode('utf-8'))
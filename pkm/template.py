@@ -3,7 +3,8 @@
 PKMeter Template
 """
 import re
-from pkm import utils
+from pkm import utils, windows
+from pkm.exceptions import ParseError
 from pkm.filters import filters
 
 
@@ -81,7 +82,7 @@ class Variable:
         if self.FILTER_SEPARATOR in self.varstr:
             self.varpath, filterstrs = self.varstr.split(self.FILTER_SEPARATOR, 1)
             filterstrs = filterstrs.split(self.FILTER_SEPARATOR)
-            self.filters = [Filter(filterstr) for filterstr in filterstrs]
+            self.filters = [Filter(filterstr, self.varpath, i) for i, filterstr in enumerate(filterstrs)]
         else:
             self.varpath = self.varstr
         self.namespace = self.varpath.split('.')[0]
@@ -100,10 +101,13 @@ class Variable:
 class Filter:
     ARGUMENT_SEPARATOR = ':'
 
-    def __init__(self, filterstr):
+    def __init__(self, filterstr, varpath=None, position=0):
         self.filterstr = filterstr
+        self.varpath = varpath
+        self.position = position
         self.filter = None
         self.arg = None
+        self.window = None
         self._parse()
 
     def __repr__(self):
@@ -117,8 +121,18 @@ class Filter:
         self.filter = filters.get(filtername)
         if not self.filter:
             raise Exception('Unknown filter: %s' % filtername)
+        if self.filter.window:
+            # Windows are fed the raw value of a plugin path, so they can not
+            # follow another filter or read rows of an iter block.
+            if self.position:
+                raise ParseError('Window filter %s must be the first filter.' % filtername)
+            if self.varpath.split('.')[0] == 'this':
+                raise ParseError('Window filter %s can not be used on %s.' % (filtername, self.varpath))
+            self.window = windows.get_window(self.varpath, self.arg)
 
     def apply(self, value):
+        if self.window:
+            return self.filter(self.window)
         if self.arg:
             return self.filter(value, self.arg)
         return self.filter(value)
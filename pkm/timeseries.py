@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Time Series Store
+History for every numeric value published by the plugins. Each tier is a
+fixed-width columnar file (one column per metric path) memory-mapped from
+disk. Samples are aggregated into their bucket in every tier as they arrive,
+so downsampling never requires a pass over older data.
+"""
+import json, numpy, os, threading, time
+from pkm import log, utils
+from pkm.decorators import never_raise
+
+TIERS = (('1s', 1, 3600), ('1m', 60, 1440), ('1h', 3600, 720))  # name, resolution, buckets
+FIELDS = ('bucket', 'count', 'sum', 'min', 'max', 'last')
+BUCKET, COUNT, SUM, MIN, MAX, LAST = range(len(FIELDS))
+INITIAL_CAPACITY = 64
+
+
+class Tier(object):
+    """ Ring of buckets stored as a (fields x buckets x columns) memmap. The
+        slot for a bucket is bucket % numslots; the bucket field tells if
+        the slot holds current data or is left over from a previous lap.
+    """
+
+    def __init__(self, dirpath, name, resolution, numslots, capacity):
+        self.path = os.path.join(dirpath, '%s.dat' % name)
+        self.name = name                                # Name of this tier
+        self.resolution = resolution                    # Seconds per bucket
+        self.numslots = numslots                        # Number of buckets kept
+        self.retention = resolution * numslots          # Seconds of history kept
+        self.data = self._open(capacity)                # Memmapped bucket data
+
+    def _open(self, capacity):
+        shape = (len(FIELDS), self.numslots, capacity)
+        size = int(numpy.prod(shape)) * 8
+        mode = 'r+' if os.path.isfile(self.path) and os.path.getsize(self.path) == size else 'w+'
+        return numpy.memmap(self.path, dtype=numpy.float64, mode=mode, shape=shape)
+
+    def add(self, cols, values, timestamp):
+        bucket = int(timestamp // self.resolution)
+        row = self.data[:, bucket % self.numslots]
+        stale = cols[row[BUCKET, cols] != bucket]
+        if len(stale):
+            row[BUCKET, stale] = bucket
+            row[COUNT, stale] = 0
+            row[SUM, stale] = 0
+            row[MIN, stale] = numpy.inf
+            row[MAX, stale] = -numpy.inf
+        row[COUNT, cols] += 1
+        row[SUM, cols] += values
+        row[MIN, cols] = numpy.minimum(row[MIN, cols], values)
+        row[MAX, cols] = numpy.maximum(row[MAX, cols], values)
+        row[LAST, cols] = values
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+    def covers(self, start, now):
+        # The bucket numslots before now shares its slot with the current
+        # bucket, so a range starting there is as covered as it can be.
+        return int(start // self.resolution) >= int(now // self.resolution) - self.numslots
+
+    def grow(self, capacity):
+        # Columns are the innermost axis, so growing means copying into a
+        # new file. This only happens when the number of metrics doubles.
+        oldcapacity = self.data.shape[2]
+        tmppath = '%s.tmp' % self.path
+        data = numpy.memmap(tmppath, dtype=numpy.float64, mode='w+', shape=(len(FIELDS), self.numslots, capacity))
+        data[:, :, :oldcapacity] = self.data
+        data.flush()
+        self.close()
+        os.replace(tmppath, self.path)
+        self.data = data
+
+    def query(self, col, start, end):
+        first = int(start // self.resolution)
+        last = int(end // self.resolution)
+        buckets = numpy.arange(max(first, last - self.numslots + 1), last + 1)
+        rows = self.data[:, buckets % self.numslots, col]
+        valid = rows[BUCKET] == buckets
+        return buckets[valid] * self.resolution, rows[:, valid]
+
+
+class TimeSeriesStore(object):
+    """ Query API for the history of any metric path, ie: system.cpu_percent.
+        Ranges are unix timestamps and default to the last hour.
+    """
+
+    def __init__(self, dirpath):
+        self.dirpath = dirpath                          # Directory to save files to
+        self.indexpath = os.path.join(dirpath, 'index.json')
+        self.lock = threading.RLock()                   # Lock for add, grow and query
+        self.columns = {}                               # Column number for each metric path
+        self.capacity = INITIAL_CAPACITY                # Columns allocated in each tier
+        os.makedirs(dirpath, exist_ok=True)
+        self._load_index()
+        self.tiers = [Tier(dirpath, name, res, slots, self.capacity) for name, res, slots in TIERS]
+
+    def _load_index(self):
+        if os.path.isfile(self.indexpath):
+            try:
+                with open(self.indexpath) as handle:
+                    index = json.load(handle)
+                self.capacity = index['capacity']
+                self.columns = {path:col for col, path in enumerate(index['paths'])}
+            except Exception as err:
+                log.warning('Unable to load history index %s: %s', self.indexpath, err)
+
+    def _save_index(self):
+        paths = sorted(self.columns, key=self.columns.get)
+        with open(self.indexpath, 'w') as handle:
+            json.dump({'capacity':self.capacity, 'paths':paths}, handle)
+
+    def _add_columns(self, paths):
+        for path in paths:
+            self.columns[path] = len(self.columns)
+        if len(self.columns) > self.capacity:
+            while len(self.columns) > self.capacity:
+                self.capacity *= 2
+            log.info('Growing history store to %s metrics.', self.capacity)
+            for tier in self.tiers:
+                tier.grow(self.capacity)
+        self._save_index()
+
+    def _tier(self, start, resolution=None):
+        # Finest tier (or requested resolution) that still covers start
+        now = time.time()
+        for tier in self.tiers:
+            if resolution and tier.resolution < resolution:
+                continue
+            if tier.covers(start, now):
+                return tier
+        return self.tiers[-1]
+
+    def _range(self, path, start, end, resolution):
+        end = end or time.time()
+        start = start or end - 3600
+        col = self.columns.get(path)
+        if col is None:
+            return numpy.array([]), numpy.zeros((len(FIELDS), 0))
+        with self.lock:
+            return self._tier(start, resolution).query(col, start, end)
+
+    @never_raise
+    def add(self, namespace, data, timestamp=None):
+        timestamp = timestamp or time.time()
+        metrics = list(utils.flatten_numeric(data, namespace))
+        if not metrics:
+            return None
+        with self.lock:
+            newpaths = [path for path, value in metrics if path not in self.columns]
+            if newpaths:
+                self._add_columns(newpaths)
+            cols = numpy.array([self.columns[path] for path, value in metrics])
+            values = numpy.array([value for path, value in metrics], dtype=numpy.float64)
+            for tier in self.tiers:
+                tier.add(cols, values, timestamp)
+
+    def aggregate(self, path, func='avg', start=None, end=None):
+        """ Single value for the range: avg, count, last, max, min or sum. """
+        timestamps, rows = self._range(path, start, end, None)
+        if not len(timestamps):
+            return None
+        if func == 'avg': return float(rows[SUM].sum() / rows[COUNT].sum())
+        if func == 'count': return int(rows[COUNT].sum())
+        if func == 'last': return float(rows[LAST][-1])
+        if func == 'max': return float(rows[MAX].max())
+        if func == 'min': return float(rows[MIN].min())
+        if func == 'sum': return float(rows[SUM].sum())
+        raise Exception('Unknown aggregate: %s' % func)
+
+    def close(self):
+        with self.lock:
+            for tier in self.tiers:
+                tier.close()
+            self.tiers = []
+
+    def paths(self, prefix=''):
+        return sorted(p for p in self.columns if p.startswith(prefix))
+
+    def query(self, path, start=None, end=None, func='avg', resolution=None):
+        """ List of (timestamp, value) per bucket. Func picks the value from
+            each bucket: avg, count, last, max, min or sum.
+        """
+        timestamps, rows = self._range(path, start, end, resolution)
+        if func == 'avg':
+            values = rows[SUM] / rows[COUNT]
+        else:
+            values = rows[FIELDS.index(func)]
+        return list(zip(timestamps.tolist(), values.tolist()))
@@ -2,12 +2,8 @@
 """
 PKMeter Utilites
 """
-import datetime, os, re, socket, struct, xmltodict
-import shlex, subprocess, threading, queue
-from urllib.parse import urlencode
-from urllib.request import urlopen
-from urllib.error import URLError
-from PyQt5 import QtGui, QtWidgets
+import datetime, fnmatch, functools, math, os, re, socket
+import shlex, struct, subprocess, xmltodict
 from pkm import log
 
 DICTTYPES = ['dict', 'ordereddict']
@@ -55,7 +51,17 @@ def flatten_datatree(root, path):
     return sorted(flatlist, key=lambda x: x[0])
 
 
+def flatten_numeric(root, path):
+    for key, value in root.items():
+        subpath = '%s.%s' % (path, key)
+        if isinstance(value, dict):
+            yield from flatten_numeric(value, subpath)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            yield subpath, value
+
+
 def hex_to_qcolor(hexstr):
+    from PyQt5 import QtGui
     hexstr = hexstr.lstrip('#')
     if len(hexstr) == 6:
         return QtGui.QColor(*struct.unpack('BBB', bytes.fromhex(hexstr)))
@@ -64,6 +70,64 @@ def hex_to_qcolor(hexstr):
     raise Exception('Invalid hexstr format: %s' % hexstr)
 
 
+@functools.lru_cache(maxsize=32)
+def ignore_matcher(ignores):
+    """ Compiled matcher for an ignores setting with one entry per line. Entries
+        are case insensitive substrings, globs matching the whole title when
+        prefixed with glob:, or regexes when prefixed with re:. Matchers are
+        cached by setting, so plugins reading the same one share it.
+        Empty and invalid entries are skipped; regexes may only use scoped
+        flags such as (?i:...) since they are joined into one pattern.
+    """
+    words, patterns = [], []
+    for ignore in ignores.split('\n'):
+        ignore = ignore.rstrip('\r')
+        if ignore.startswith('re:'):
+            pattern = ignore[3:]
+        elif ignore.startswith('glob:'):
+            pattern = '^%s' % fnmatch.translate(ignore[5:]) if ignore[5:].strip() else None
+        elif ignore.strip():
+            words.append(ignore.lower())
+            continue
+        else:
+            pattern = None
+        if not pattern:
+            continue
+        try:
+            # Compile as one of several alternatives to reject global flags
+            re.compile('x|(?:%s)' % pattern)
+            patterns.append('(?:%s)' % pattern)
+        except re.error as err:
+            log.warning('Invalid ignore %r: %s', ignore, err)
+    if words:
+        patterns.append(_trie_pattern(words))
+    try:
+        regex = re.compile('|'.join(patterns), re.IGNORECASE) if patterns else None
+    except re.error as err:
+        log.warning('Invalid ignores, only matching plain text: %s', err)
+        regex = re.compile(_trie_pattern(words), re.IGNORECASE) if words else None
+    if not regex:
+        return lambda title: False
+    return lambda title: bool(title) and regex.search(title) is not None
+
+
+def _trie_pattern(words):
+    # Substrings as one regex trie (ie: ab|ac -> a(?:b|c)); the re module
+    # tries alternatives one by one, so this is much faster for long lists.
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+    def _pattern(node):
+        if '' in node:
+            return ''  # Any longer words also match here
+        alts = [re.escape(char) + _pattern(child) for char, child in sorted(node.items())]
+        return alts[0] if len(alts) == 1 else '(?:%s)' % '|'.join(alts)
+    return _pattern(trie)
+
+
 def addr_to_ip(addr):
     try:
         socket.inet_aton(addr)
@@ -72,32 +136,6 @@ def addr_to_ip(addr):
         return False
 
 
-def http_request(url, data=None, timeout=30):
-    log.debug("Requesting URL: %s" % url)
-    data = urlencode(data).encode('utf8') if data else None
-    try:
-        response = urlopen(url, data=data, timeout=timeout)
-        return {'success':True, 'response':response, 'url':url}
-    except Exception as err:
-        log.error("Error requesting URL: %s; %s" % (url, err))
-        return {'success':False, 'error':err, 'url':url}
-
-
-def iter_responses(urls, data=None, timeout=30):
-    responses = queue.Queue()
-    threads = []
-    _req = lambda url, data, timeout: responses.put(http_request(url, data, timeout))
-    for url in urls:
-        threads.append(threading.Thread(target=_req, args=(url, data, timeout)))
-        threads[-1].daemon = True
-        threads[-1].start()
-    for thread in threads:
-        thread.join()
-    responses.put(None)
-    for response in iter(responses.get, None):
-        yield response
-
-
 def name(module):
     return getattr(module, 'NAME', namespace(module))
 
@@ -185,6 +223,7 @@ def value_type(value):
 
 
 def window_bgcolor():
+    from PyQt5 import QtGui, QtWidgets
     tmp = QtWidgets.QWidget()
     return tmp.palette().color(QtGui.QPalette.Window)
 
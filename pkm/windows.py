@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter Rolling Windows
+Recent values for variables used with a history filter such as
+{{system.cpu_percent|avg:"60s"}}. Windows are only created for paths
+referenced by the layout and every aggregate is updated as values arrive,
+so reading one never scans the window.
+"""
+import bisect, math, re, time
+from collections import defaultdict, deque
+from pkm import utils
+from pkm.exceptions import ParseError
+
+UNITS = {'s':1, 'm':60, 'h':3600, 'd':86400}
+DEFAULT_DURATION = '60s'
+
+
+windows = {}
+namespaces = defaultdict(list)
+def get_window(varpath, duration=None):  # NOQA
+    seconds = to_seconds(duration or DEFAULT_DURATION)
+    if (varpath, seconds) not in windows:
+        window = Window(varpath, seconds)
+        windows[(varpath, seconds)] = window
+        namespaces[window.namespace].append(window)
+    return windows[(varpath, seconds)]
+
+
+def to_seconds(duration):
+    match = re.match(r'^(\d+(?:\.\d+)?)([smhd]?)$', duration.strip().lower())
+    if not match:
+        raise ParseError('Invalid window duration: %s' % duration)
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+def update_windows(namespace, data, now=None):
+    now = now or time.monotonic()
+    for window in namespaces.get(namespace, []):
+        window.add(utils.rget(data, window.varpath), now)
+
+
+class Window:
+
+    def __init__(self, varpath, seconds):
+        self.varpath = varpath          # Variable path to collect
+        self.namespace = varpath.split('.')[0]
+        self.seconds = seconds          # Length of the window
+        self.samples = deque()          # (timestamp, value) oldest first
+        self.total = 0.0                # Sum of all values
+        self.maxes = deque()            # Decreasing (timestamp, value)
+        self.mins = deque()             # Increasing (timestamp, value)
+        self.sorted = None              # Sorted values (once a percentile is read)
+
+    def __repr__(self):
+        return '<Window:%s:%ss>' % (self.varpath, self.seconds)
+
+    def add(self, value, now):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        if not math.isfinite(value):
+            return None
+        self._expire(now - self.seconds)
+        self.samples.append((now, value))
+        self.total += value
+        while self.maxes and self.maxes[-1][1] <= value:
+            self.maxes.pop()
+        self.maxes.append((now, value))
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((now, value))
+        if self.sorted is not None:
+            bisect.insort(self.sorted, value)
+
+    def _expire(self, cutoff):
+        while self.samples and self.samples[0][0] <= cutoff:
+            timestamp, value = self.samples.popleft()
+            self.total -= value
+            if self.sorted is not None:
+                del self.sorted[bisect.bisect_left(self.sorted, value)]
+        while self.maxes and self.maxes[0][0] <= cutoff:
+            self.maxes.popleft()
+        while self.mins and self.mins[0][0] <= cutoff:
+            self.mins.popleft()
+        if not self.samples:
+            self.total = 0.0
+
+    def avg(self):
+        if not self.samples: return None
+        return self.total / len(self.samples)
+
+    def max(self):
+        return self.maxes[0][1] if self.maxes else None
+
+    def min(self):
+        return self.mins[0][1] if self.mins else None
+
+    def percentile(self, percent):
+        if not self.samples: return None
+        if self.sorted is None:
+            self.sorted = sorted(value for timestamp, value in self.samples)
+        index = max(0, math.ceil(percent / 100.0 * len(self.sorted)) - 1)
+        return self.sorted[index]
+
+    def rate(self):
+        if len(self.samples) < 2: return None
+        (t1, v1), (t2, v2) = self.samples[0], self.samples[-1]
+        return (v2 - v1) / (t2 - t1) if t2 > t1 else None
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+PKMeter tests and test helpers
+"""
+
+
+class FakeSignal(object):
+
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, *args):
+        self.emitted.append(args)
+
+
+class FakeConfig(object):
+
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    def get(self, namespace, item, default=None, from_keyring=False):
+        return self.values.get(namespace, {}).get(item, default)
+
+
+class FakePKMeter(object):
+    """ Just enough of PKMeter to run a plugin without Qt. """
+
+    def __init__(self, config=None, actions=None):
+        self.config = FakeConfig(config)
+        self.actions = actions or {}
+        self.plugin_updated = FakeSignal()
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Shared test fixtures
+"""
+import pytest
+from tests import FakePKMeter
+
+
+@pytest.fixture
+def pkmeter():
+    return FakePKMeter()
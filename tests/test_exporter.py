@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the Prometheus metrics exporter
+"""
+from pkm import exporter
+
+
+def _lines(namespace, data):
+    return exporter.render(namespace, data).decode('utf8').splitlines()
+
+
+def test_numeric_leaves():
+    lines = _lines('system', {'cpu_percent':12.5, 'enabled':True, 'name':'host', 'nan':float('nan')})
+    assert 'pkmeter_system_cpu_percent 12.5' in lines
+    assert 'pkmeter_system_enabled 1' in lines
+    assert not [line for line in lines if 'name' in line or 'nan' in line]
+
+
+def test_list_items_are_labeled():
+    lines = _lines('network', {'nics':[{'iface':'eth0', 'bytes_recv':10}, {'iface':'wlan0', 'bytes_recv':20}]})
+    assert 'pkmeter_network_nics_bytes_recv{iface="eth0"} 10' in lines
+    assert 'pkmeter_network_nics_bytes_recv{iface="wlan0"} 20' in lines
+
+
+def test_users_are_labeled_by_username():
+    lines = _lines('processes', {'users':[{'username':'root', 'count':80}, {'username':'pk', 'count':20}]})
+    assert 'pkmeter_processes_users_count{username="root"} 80' in lines
+    assert 'pkmeter_processes_users_count{username="pk"} 20' in lines
+
+
+def test_duplicate_labels_get_the_index():
+    events = [{'title':'Standup', 'start':1}, {'title':'Lunch', 'start':2}, {'title':'Standup', 'start':3}]
+    lines = _lines('gcal', {'events':events})
+    assert 'pkmeter_gcal_events_start{title="Standup",index="0"} 1' in lines
+    assert 'pkmeter_gcal_events_start{title="Lunch"} 2' in lines
+    assert 'pkmeter_gcal_events_start{title="Standup",index="2"} 3' in lines
+    series = [line.rsplit(' ', 1)[0] for line in lines if not line.startswith('#')]
+    assert len(series) == len(set(series))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for filesystem usage checks
+"""
+import threading
+from collections import namedtuple
+from pkm.plugins import filesystem
+
+Usage = namedtuple('Usage', 'total used free percent')
+
+
+def test_usage_check_reuses_one_worker(monkeypatch):
+    idents = []
+    def disk_usage(mountpoint):
+        idents.append(threading.get_ident())
+        return Usage(100, 25, 75, 25.0)
+    monkeypatch.setattr(filesystem.psutil, 'disk_usage', disk_usage)
+    check = filesystem.UsageCheck('/')
+    for i in range(5):
+        check.start()
+        assert check.done.wait(5)
+    assert check.usage['percent_free'] == 75.0
+    assert len(idents) == 5 and set(idents) == {check.thread.ident}
+    check.close()
+    check.thread.join(5)
+    assert not check.thread.is_alive()
+
+
+def test_hung_mount_is_skipped(monkeypatch):
+    release, calls = threading.Event(), []
+    def disk_usage(mountpoint):
+        calls.append(mountpoint)
+        release.wait(5)
+        return Usage(100, 50, 50, 50.0)
+    monkeypatch.setattr(filesystem.psutil, 'disk_usage', disk_usage)
+    check = filesystem.UsageCheck('/mnt/nfs')
+    threads = threading.active_count()
+    for i in range(10):
+        check.start()
+        assert not check.done.wait(0.01)
+    assert threading.active_count() == threads
+    assert calls == ['/mnt/nfs']
+    release.set()
+    assert check.done.wait(5)
+    assert check.usage['percent'] == 50.0
+    check.close()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for gcal recurrence expansion
+"""
+import datetime, pytest, random
+from dateutil import rrule
+from pkm.plugins import gcal
+
+RULES = ('FREQ=DAILY', 'FREQ=DAILY;INTERVAL=3', 'FREQ=WEEKLY;BYDAY=MO,WE', 'FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,SU',
+    'FREQ=WEEKLY;INTERVAL=3', 'FREQ=MONTHLY;BYDAY=2TU', 'FREQ=MONTHLY', 'FREQ=MONTHLY;INTERVAL=5', 'FREQ=YEARLY',
+    'FREQ=YEARLY;INTERVAL=2;BYMONTH=3,10', 'FREQ=MONTHLY;BYMONTHDAY=-1', 'FREQ=MONTHLY;BYSETPOS=-1;BYDAY=MO,TU,WE,TH,FR',
+    'FREQ=WEEKLY;COUNT=500', 'FREQ=DAILY;UNTIL=20200301T000000', 'FREQ=WEEKLY;WKST=SU;BYDAY=SU,SA;INTERVAL=2')
+
+
+@pytest.fixture
+def plugin(pkmeter):
+    return gcal.Plugin(pkmeter)
+
+
+def _starts(plugin, rulestr, start, today, exdates=(), moved=()):
+    plugin.starts = {}
+    event = {'uid':'x', 'start':start.isoformat(), 'rrule':rulestr, 'exdates':[d.isoformat() for d in exdates]}
+    return plugin._event_starts(event, today, {('x', d.isoformat()) for d in moved})
+
+
+def test_jumped_rules_match_plain_rrule(plugin):
+    random.seed(1)
+    for i in range(500):
+        if random.random() < 0.2:
+            start = random.choice([datetime.datetime(2012, 2, 29, 9), datetime.datetime(2011, 1, 31, 8)])
+        else:
+            start = datetime.datetime(2010, 1, 1, 9) + datetime.timedelta(days=random.randint(0, 3000), hours=random.randint(0, 10))
+        today = datetime.datetime(2018, 1, 1) + datetime.timedelta(days=random.randint(0, 2000))
+        rulestr = random.choice(RULES)
+        expected = rrule.rrulestr(rulestr, dtstart=start).between(today, today + gcal.WINDOW, inc=True)
+        assert _starts(plugin, rulestr, start, today) == expected, (rulestr, start, today)
+
+
+def test_exdates_and_moved_occurrences(plugin):
+    today = datetime.datetime(2024, 5, 1)
+    start = datetime.datetime(2014, 5, 1, 9)
+    starts = _starts(plugin, 'FREQ=DAILY', start, today, exdates=[datetime.datetime(2024, 5, 3, 9)],
+        moved=[datetime.datetime(2024, 5, 4, 9)])
+    assert [s.day for s in starts] == [1, 2, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14]
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Tests and benchmark for pkm.httpclient against a local stand-in server
+"""
+import gzip, pytest, socket, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pkm import httpclient
+
+BENCH_REQUESTS = 200
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super(Handler, self).setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.server.connections.append(self.connection)
+
+    def do_GET(self):
+        self.server.requests.append(('GET', self.path))
+        if self.path == '/etag':
+            if self.headers.get('If-None-Match') == '"v1"':
+                return self._reply(304, b'', {'ETag':'"v1"'})
+            return self._reply(200, b'etag body', {'ETag':'"v1"'})
+        if self.path.startswith('/gzip/'):
+            body = gzip.compress(b'x' * int(self.path[6:]))
+            return self._reply(200, body, {'Content-Encoding':'gzip'})
+        if self.path.startswith('/size/'):
+            return self._reply(200, b'x' * int(self.path[6:]), {'ETag':'"%s"' % self.path})
+        return self._reply(200, b'hello')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.server.requests.append(('POST', self.rfile.read(length)))
+        self._reply(200, b'posted')
+
+    def _reply(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.connections, server.requests = [], []
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, args=[0.05], daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    for name in ('http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY', 'no_proxy', 'NO_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(httpclient, 'pools', {})
+    monkeypatch.setattr(httpclient, 'cache', httpclient.OrderedDict())
+    monkeypatch.setattr(httpclient, 'cachebytes', 0)
+    monkeypatch.setattr(httpclient, 'failing', set())
+
+
+def _drop_connections(server):
+    # Close the server side of every open connection, as an idle timeout would
+    for conn in server.connections:
+        try:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    time.sleep(0.05)
+
+
+def test_connections_are_reused(server):
+    for i in range(5):
+        assert httpclient.request(server.url + '/')['response'].body == b'hello'
+    assert len(server.connections) == 1
+
+
+def test_etag_revalidation(server):
+    first = httpclient.request(server.url + '/etag')
+    second = httpclient.request(server.url + '/etag')
+    assert second['status'] == 200
+    assert second['response'].body == b'etag body'
+    assert second['response'] is first['response']
+
+
+def test_conditional_requests_are_not_cached(server):
+    result = httpclient.request(server.url + '/etag', headers={'If-None-Match':'"v0"'})
+    assert result['response'].body == b'etag body'
+    assert not httpclient.cache
+    result = httpclient.request(server.url + '/etag', headers={'If-None-Match':'"v1"'})
+    assert result['success'] and result['status'] == 304 and result['response'] is None
+
+
+def test_cache_is_limited_by_size(server, monkeypatch):
+    monkeypatch.setattr(httpclient, 'MAXCACHEBYTES', 2000)
+    for size in (400, 410, 420, 430, 440):
+        httpclient.request(server.url + '/size/%s' % size)
+    assert list(httpclient.cache) == [server.url + '/size/%s' % size for size in (410, 420, 430, 440)]
+    assert httpclient.cachebytes == 1700
+    httpclient.request(server.url + '/size/501')
+    assert server.url + '/size/501' not in httpclient.cache
+
+
+def test_gzip_and_size_limit(server):
+    assert httpclient.request(server.url + '/gzip/5000')['response'].body == b'x' * 5000
+    result = httpclient.request(server.url + '/gzip/5000', maxsize=4999)
+    assert not result['success']
+    assert 'larger than 4999' in str(result['error'])
+
+
+def test_get_is_retried_on_a_dropped_connection(server):
+    httpclient.request(server.url + '/')
+    _drop_connections(server)
+    assert httpclient.request(server.url + '/')['success']
+    assert len(server.connections) == 2
+
+
+def test_post_is_not_retried(server):
+    httpclient.request(server.url + '/')
+    _drop_connections(server)
+    assert not httpclient.request(server.url + '/', data={'a':1})['success']
+    assert httpclient.request(server.url + '/', data={'a':1})['response'].body == b'posted'
+    assert [r for r in server.requests if r[0] == 'POST'] == [('POST', b'a=1')]
+
+
+def test_http_proxy(server, monkeypatch):
+    monkeypatch.setenv('http_proxy', server.url)
+    result = httpclient.request('http://example.invalid/path?q=1')
+    assert result['response'].body == b'hello'
+    assert server.requests[-1] == ('GET', 'http://example.invalid/path?q=1')
+
+
+def _bench(url, count):
+    start = time.perf_counter()
+    for i in range(count):
+        assert httpclient.request(url)['success']
+    return (time.perf_counter() - start) / count
+
+
+def test_bench_pooled_latency(server, monkeypatch):
+    url = server.url + '/'
+    monkeypatch.setattr(httpclient, 'MAXIDLE', 0)
+    unpooled = _bench(url, BENCH_REQUESTS)
+    assert len(server.connections) == BENCH_REQUESTS
+    monkeypatch.setattr(httpclient, 'MAXIDLE', 4)
+    pooled = _bench(url, BENCH_REQUESTS)
+    assert len(server.connections) == BENCH_REQUESTS + 1
+    print('\nhttpclient latency: %.3fms pooled, %.3fms unpooled' % (pooled * 1000, unpooled * 1000))
+    assert pooled < unpooled * 1.5
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the lmsensors plugin against a fake hwmon tree
+"""
+import os, pytest
+from pkm.plugins import lmsensors
+
+
+def _hwmon(root, name, files, device=None):
+    path = root.mkdir(name)
+    for filename, content in files.items():
+        path.join(filename).write(content)
+    if device:
+        device = root.join('devices', device)
+        device.ensure(dir=True)
+        os.symlink(str(device), str(path.join('device')))
+    return path
+
+
+@pytest.fixture
+def hwmon(tmpdir):
+    _hwmon(tmpdir, 'hwmon0', {'name':'coretemp\n', 'temp1_input':'41000\n', 'temp1_label':'Package id 0\n',
+        'temp2_input':'38500\n', 'fan1_input':'1200\n', 'in0_input':'1104\n'}, 'platform/coretemp.0')
+    _hwmon(tmpdir, 'hwmon1', {'name':'acpitz\n', 'temp1_input':'27800\n'}, 'LNXSYSTM:00/LNXTHERM:00')
+    return tmpdir
+
+
+def _values(reader):
+    return {chip:(adapter, dict(features)) for chip, adapter, features in reader.read()}
+
+
+def test_reads_scaled_values(hwmon):
+    reader = lmsensors.HwmonReader(root=str(hwmon))
+    values = _values(reader)
+    assert sorted(values) == ['acpitz-acpi', 'coretemp-isa']
+    adapter, features = values['coretemp-isa']
+    assert adapter == 'isa adapter'
+    assert features == {'package_id_0':41.0, 'temp2':38.5, 'fan1':1200, 'in0':1.104}
+    assert values['acpitz-acpi'] == ('acpi interface', {'temp1':27.8})
+    reader.close()
+
+
+def test_rereads_changed_values(hwmon):
+    reader = lmsensors.HwmonReader(root=str(hwmon))
+    hwmon.join('hwmon0', 'temp2_input').write('40000\n')
+    assert _values(reader)['coretemp-isa'][1]['temp2'] == 40.0
+    reader.close()
+
+
+def test_unreadable_inputs_are_none(hwmon):
+    hwmon.join('hwmon0', 'temp3_input').mkdir()  # pread fails with EISDIR
+    hwmon.join('hwmon0', 'temp4_input').write('N/A\n')
+    reader = lmsensors.HwmonReader(root=str(hwmon))
+    features = _values(reader)['coretemp-isa'][1]
+    assert features['temp3'] is None
+    assert features['temp4'] is None
+    assert features['temp2'] == 38.5
+    assert len(reader.sensors) == 7  # Nothing rediscovered
+    reader.close()
+
+
+def test_rediscovers_when_nothing_can_be_read(tmpdir):
+    _hwmon(tmpdir, 'hwmon0', {'name':'coretemp\n', 'temp1_input':'N/A\n'})
+    reader = lmsensors.HwmonReader(root=str(tmpdir))
+    tmpdir.join('hwmon0').remove()
+    _hwmon(tmpdir, 'hwmon1', {'name':'nct6775\n', 'temp1_input':'30000\n'})
+    assert _values(reader)['coretemp-virtual'][1] == {'temp1':None}
+    assert _values(reader)['nct6775-virtual'][1] == {'temp1':30.0}
+    reader.close()
+
+
+def test_plugin_publishes_aliases(hwmon, pkmeter):
+    plugin = lmsensors.Plugin(pkmeter)
+    plugin.reader = lmsensors.HwmonReader(root=str(hwmon))
+    plugin.chips, plugin.adapters = None, {}
+    plugin.update()
+    isa = plugin.data['isa'][0]
+    assert isa['cpu_temperature'] == 38.5
+    assert isa['temp2'] == 38.5
+    assert plugin.data['acpi'][0]['mb_temperature'] == 27.8
+    hwmon.join('hwmon0', 'temp2_input').write('50000\n')
+    plugin.update()
+    assert plugin.data['isa'][0] is isa
+    assert isa['cpu_temperature'] == 50.0
+    plugin.reader.close()
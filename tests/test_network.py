@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the network plugin
+"""
+import errno, pytest, socket, time
+from collections import Counter, namedtuple
+from pkm.plugins import network
+
+IO = namedtuple('IO', 'bytes_sent bytes_recv packets_sent packets_recv errin errout dropin dropout')
+NET_ROWS = (('tcp', 'tcp', 70000), ('tcp', 'tcp6', 20000), ('udp', 'udp', 8000), ('udp', 'udp6', 2000))
+NET_STATES = ('01', '01', '01', '06', '08', '02')
+NET_BUDGET = 0.5    # Seconds to read all 100k rows
+
+
+@pytest.fixture
+def plugin(pkmeter, monkeypatch):
+    plugin = network.Plugin(pkmeter)
+    plugin.nics, plugin.addrs, plugin.samples = {}, {}, {}
+    plugin.ignores, plugin.smoothing = [], 0
+    plugin.next_connections = float('inf')
+    plugin.watcher = network.AddressWatcher.__new__(network.AddressWatcher)
+    plugin.watcher.sock, plugin.watcher.lastpoll = None, float('inf')
+    monkeypatch.setattr(plugin, '_address', lambda iface: {'addr':'10.0.0.2'})
+    return plugin
+
+
+def _counters(monkeypatch, sent, recv):
+    io = IO(sent, recv, 0, 0, 0, 0, 0, 0)
+    monkeypatch.setattr(network.psutil, 'net_io_counters', lambda pernic=False: {'eth0':io} if pernic else io)
+
+
+def test_rates_without_bookkeeping_keys(plugin, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(network.time, 'monotonic', lambda: clock[0])
+    _counters(monkeypatch, 1000, 5000)
+    plugin.update()
+    clock[0] = 102.0
+    _counters(monkeypatch, 3000, 9000)
+    plugin.update()
+    nic = plugin.data['nics'][0]
+    assert nic['bytes_sent_per_sec'] == 1000
+    assert nic['bytes_recv_per_sec'] == 2000
+    assert plugin.data['total']['bytes_recv_per_sec'] == 2000
+    for data in (nic, plugin.data['total']):
+        assert 'monotonic' not in data
+        assert 'updated' not in data
+
+
+class FailingSocket(object):
+
+    def __init__(self, err):
+        self.err = err
+        self.calls = 0
+        self.closed = False
+
+    def recv(self, size):
+        self.calls += 1
+        raise self.err
+
+    def close(self):
+        self.closed = True
+
+
+def _watcher(sock):
+    watcher = network.AddressWatcher.__new__(network.AddressWatcher)
+    watcher.sock, watcher.lastpoll = sock, float('inf')
+    return watcher
+
+
+def test_watcher_stops_on_socket_error():
+    sock = FailingSocket(OSError(errno.EBADF, 'Bad file descriptor'))
+    watcher = _watcher(sock)
+    assert watcher.changed()
+    assert sock.calls == 1 and sock.closed
+    assert watcher.sock is None
+    assert not watcher.changed()
+
+
+def test_watcher_keeps_socket_after_overflow():
+    sock = FailingSocket(OSError(errno.ENOBUFS, 'No buffer space available'))
+    watcher = _watcher(sock)
+    assert watcher.changed()
+    assert sock.calls == 1 and not sock.closed
+    assert watcher.sock is sock
+
+
+def _hexaddr(ip, ipv6):
+    # /proc/net addresses are 32bit words in host (little endian) byte order
+    if ipv6:
+        packed = socket.inet_pton(socket.AF_INET6, ip if ':' in ip else '::ffff:%s' % ip)
+    else:
+        packed = socket.inet_aton(ip)
+    return b''.join(packed[i:i+4][::-1] for i in range(0, len(packed), 4)).hex().upper()
+
+
+@pytest.fixture(scope='module')
+def proc_net(tmpdir_factory):
+    """ Generated /proc/net tables with 100k rows and the stats they hold. """
+    root = tmpdir_factory.mktemp('proc_net')
+    files, expected = [], {'tcp':0, 'udp':0, 'states':Counter(), 'listening':set(), 'remotes':Counter()}
+    for proto, name, numrows in NET_ROWS:
+        ipv6 = name.endswith('6')
+        lines = ['  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode']
+        for i in range(numrows):
+            if i < 40:
+                state, port, remote = '0A' if proto == 'tcp' else '07', 1000 + i, '0.0.0.0'
+            elif proto == 'tcp':
+                state, port, remote = NET_STATES[i % len(NET_STATES)], 40000 + i % 20000, '10.0.%s.%s' % (i % 7, i % 13)
+            else:
+                state, port, remote = '01', 40000 + i % 20000, '192.168.1.%s' % (i % 250)
+            lines.append('%6d: %s:%04X %s:%04X %s 00000000:00000000 00:00000000 00000000  1000        0 %d 1 '
+                '0000000000000000 100 0 0 10 0' % (i, _hexaddr('127.0.0.1', ipv6), port,
+                _hexaddr(remote, ipv6), 443 if remote != '0.0.0.0' else 0, state, 100000 + i))
+            expected[proto] += 1
+            if proto == 'tcp':
+                expected['states'][state] += 1
+                if state == '0A': expected['listening'].add((proto, port))
+                else: expected['remotes'][remote] += 1
+            elif state == '07' and remote == '0.0.0.0':
+                expected['listening'].add((proto, port))
+        root.join(name).write('\n'.join(lines) + '\n')
+        files.append((proto, str(root.join(name))))
+    return files, expected
+
+
+def test_read_connections(proc_net):
+    files, expected = proc_net
+    stats = network.read_connections(files, numremotes=5)
+    assert stats['total'] == 100000
+    assert stats['tcp'] == expected['tcp'] and stats['udp'] == expected['udp']
+    states = {name:expected['states'][code.decode()] for code, name in network.TCP_STATES.items()}
+    assert stats['states'] == states
+    assert stats['listening'] == [{'proto':p, 'port':port} for p, port in sorted(expected['listening'])]
+    assert [(r['addr'], r['count']) for r in stats['remotes']] == expected['remotes'].most_common(5)
+
+
+def test_bench_read_connections(proc_net):
+    files, expected = proc_net
+    start = time.perf_counter()
+    network.read_connections(files)
+    elapsed = time.perf_counter() - start
+    print('\nread_connections: %.1fms for 100k rows' % (elapsed * 1000))
+    assert elapsed < NET_BUDGET
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Tests and benchmark for the nvidia plugin providers, driven by fixture text
+"""
+import os, pytest, sys, time
+from pkm.plugins import nvidia
+from tests import FakePKMeter
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+SMI_FIXTURE = os.path.join(FIXTURES, 'nvidia_smi.csv')
+SETTINGS_FIXTURE = os.path.join(FIXTURES, 'nvidia_settings.txt')
+BENCH_UPDATES = 10000
+
+
+def test_provider_is_abstract():
+    with pytest.raises(TypeError):
+        nvidia.Provider()
+
+
+def test_parse_smi_line():
+    values = nvidia.parse_smi_line('GeForce GTX 1080, 470.82.00, 45, [Not Supported], 3, 1, 8119, 412.5\n')
+    assert values == {'card':'GeForce GTX 1080', 'nvidiadriverversion':'470.82.00', 'gpucoretemp':45,
+        'gpuutilization_graphics':3, 'gpuutilization_memory':1, 'totaldedicatedgpumemory':8119,
+        'useddedicatedgpumemory':412}
+    assert nvidia.parse_smi_line('Failed to initialize NVML') is None
+
+
+def test_settings_provider_parses_the_same_keys(monkeypatch):
+    with open(SETTINGS_FIXTURE) as handle:
+        output = handle.read()
+    monkeypatch.setattr(nvidia.utils, 'get_stdout', lambda cmd: 'NVIDIA' if '--version' in cmd else output)
+    values = nvidia.SettingsProvider().sample()
+    smi = nvidia.parse_smi_line(open(SMI_FIXTURE).readline())
+    assert set(smi) - {'gpucurrentfanspeedrpm'} <= set(values)
+    assert values['gpucurrentfanspeedrpm'] == '1150'
+    assert values['gpuutilization_graphics'] == 3
+    assert values['useddedicatedgpumemory'] == '412'
+
+
+def _plugin():
+    plugin = nvidia.Plugin(FakePKMeter())
+    plugin.pkmeter.config.values[plugin.namespace] = {'provider':'fake:%s' % SMI_FIXTURE}
+    plugin.attrs = set()
+    plugin.provider = plugin._init_provider()
+    return plugin
+
+
+def test_plugin_replays_fixture():
+    plugin = _plugin()
+    plugin.update()
+    assert plugin.data['gpucurrentfanspeedrpm'] == 23
+    assert plugin.data['freededicatedgpumemory'] == 8119 - 412
+    assert plugin.data['percentuseddedicatedgpumemory'] == 5
+    for i in range(3):
+        plugin.update()
+    assert 'gpucurrentfanspeedrpm' not in plugin.data  # Not supported on the last line
+    assert plugin.data['gpuutilization_graphics'] == 60
+
+
+def _fake_smi(tmpdir, lines):
+    script = tmpdir.join('nvidia-smi.py')
+    script.write('import time\nfor line in %r:\n    print(line, flush=True)\ntime.sleep(60)\n' % lines)
+    return '%s %s' % (sys.executable, script)
+
+
+def test_smi_provider_streams_lines(tmpdir, monkeypatch):
+    lines = open(SMI_FIXTURE).read().splitlines()
+    monkeypatch.setattr(nvidia, 'NVIDIA_SMI', _fake_smi(tmpdir, lines[:2]))
+    provider = nvidia.SMIProvider(1)
+    try:
+        deadline = time.time() + 5
+        while provider.sample().get('gpucoretemp') != 47 and time.time() < deadline:
+            time.sleep(0.01)
+        assert provider.sample()['gpucoretemp'] == 47
+    finally:
+        provider.close()
+
+
+def test_smi_provider_backs_off_restarts(tmpdir, monkeypatch):
+    provider = nvidia.SMIProvider.__new__(nvidia.SMIProvider)
+    provider.interval, provider.latest, provider.restarts, provider.restart_at = 1, {}, 0, 0
+    starts = []
+    monkeypatch.setattr(provider, '_start', lambda: starts.append(time.time()))
+    provider.proc = type('Proc', (), {'returncode':1, 'poll':lambda self: 1})()
+    clock = [1000.0]
+    monkeypatch.setattr(nvidia.time, 'time', lambda: clock[0])
+    delays = []
+    for i in range(12):
+        assert provider.sample() == {}
+        delays.append(provider.restart_at - clock[0])
+        clock[0] = provider.restart_at
+    assert delays[:5] == [1, 2, 4, 8, 16]
+    assert max(delays) == nvidia.MAX_RESTART_DELAY
+    assert len(starts) == 12
+
+
+def test_bench_fake_provider_update():
+    plugin = _plugin()
+    start = time.perf_counter()
+    for i in range(BENCH_UPDATES):
+        plugin.update()
+    elapsed = (time.perf_counter() - start) / BENCH_UPDATES
+    print('\nnvidia update with fake provider: %.1fus' % (elapsed * 1000000))
+    assert elapsed < 0.001
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Tests and paint time benchmark for the line chart, rendered offscreen
+"""
+import os, pytest, random, time
+from xml.etree import ElementTree
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtGui, QtWidgets  # NOQA
+from pkm.pkcharts import PKLineChart, RingBuffer  # NOQA
+
+FRAMES = 200
+FRAME_BUDGET = 0.005    # Seconds per scrolled frame
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def chart(app):
+    etree = ElementTree.fromstring("<linechart colors='#ff0000,#00ff00'/>")
+    chart = PKLineChart(etree, None)
+    chart.resize(300, 60)
+    chart.data = RingBuffer(600, 2)
+    chart.data.set_window(int(chart.width() / chart.pxperpt))
+    chart.maxvalue = 100
+    random.seed(1)
+    for i in range(chart.data.window):
+        _append(chart)
+    return chart
+
+
+def _append(chart):
+    chart.data.append([random.uniform(0, 100), random.uniform(0, 100)])
+
+
+def _frame(chart, target):
+    start = time.perf_counter()
+    chart.render(target)
+    return time.perf_counter() - start
+
+
+def test_ring_buffer_window_max():
+    buf = RingBuffer(10, 1)
+    buf.set_window(3)
+    for value in (5, 1, 2, 3):
+        buf.append([value])
+    assert buf.max() == 3
+    assert buf.values().ravel().tolist() == [1, 2, 3]
+    buf = buf.resized(20)
+    assert buf.values(window=4).ravel().tolist() == [5, 1, 2, 3]
+
+
+def test_bench_paint_time(chart):
+    target = QtGui.QPixmap(chart.size())
+    full = []
+    for i in range(FRAMES // 10):
+        chart.drawn = (None, 0, None, None)  # Force a full redraw
+        full.append(_frame(chart, target))
+    scrolled, newpoint = [], []
+    for i in range(FRAMES):
+        if i % 10 == 0:
+            _append(chart)
+            newpoint.append(_frame(chart, target))
+        else:
+            chart.offset = chart.pxperpt * (i % 10) / 10.0
+            scrolled.append(_frame(chart, target))
+    avg = lambda times: sum(times) / len(times)
+    print('\nlinechart paint: %.3fms full redraw, %.3fms new point, %.3fms scrolled' % (
+        avg(full) * 1000, avg(newpoint) * 1000, avg(scrolled) * 1000))
+    assert chart.drawn[1] == chart.data.count
+    assert avg(scrolled) < FRAME_BUDGET
+    assert avg(newpoint) < avg(full)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the shared Plex connections
+"""
+import pytest, threading
+from plexapi.exceptions import Unauthorized
+from pkm import plex
+
+
+class FakeAccount(object):
+    passwords = {'pk':'secret'}
+    blocked = {}        # Events that resource().connect() waits for by host
+    connects = []
+
+    def __init__(self, username=None, password=None, token=None, session=None):
+        if token:
+            self.username = token.split(':')[0]
+        elif self.passwords.get(username) == password:
+            self.username = username
+        else:
+            raise Unauthorized('Invalid password')
+        self.authenticationToken = '%s:token' % self.username
+
+    def resource(self, host):
+        account = self
+        class Resource(object):
+            def connect(self):
+                if host in account.blocked:
+                    account.blocked[host].wait(5)
+                account.connects.append(host)
+                return object()
+        return Resource()
+
+
+@pytest.fixture(autouse=True)
+def fake_plex(monkeypatch, pkmeter):
+    monkeypatch.setattr(plex, 'MyPlexAccount', FakeAccount)
+    monkeypatch.setattr(plex, 'connections', {})
+    monkeypatch.setattr(plex, 'hostlocks', {})
+    monkeypatch.setattr(plex, 'tokens', {})
+    FakeAccount.blocked, FakeAccount.connects = {}, []
+    pkmeter.config.values['plexserver'] = {'username':'pk', 'password':'secret', 'host':'media'}
+
+
+def test_connection_is_shared(pkmeter):
+    assert plex.get_plex(pkmeter) is plex.get_plex(pkmeter)
+    assert FakeAccount.connects == ['media']
+
+
+def test_failed_reconnect_keeps_the_shared_connection(pkmeter):
+    shared = plex.get_plex(pkmeter)
+    with pytest.raises(Unauthorized):
+        plex.get_plex(pkmeter, 'pk', 'wrong', 'media', reconnect=True)
+    assert plex.get_plex(pkmeter) is shared
+    assert plex.tokens == {'pk':'pk:token'}
+    fresh = plex.get_plex(pkmeter, 'pk', 'secret', 'media', reconnect=True)
+    assert fresh is not shared
+    assert plex.get_plex(pkmeter) is fresh
+
+
+def test_slow_host_does_not_block_others(pkmeter):
+    FakeAccount.blocked['slow'] = threading.Event()
+    thread = threading.Thread(target=plex.get_plex, args=[pkmeter, None, None, 'slow'])
+    thread.start()
+    try:
+        assert plex.get_plex(pkmeter, host='fast')
+        assert plex.signin('pk', 'secret')
+        assert FakeAccount.connects == ['fast']
+    finally:
+        FakeAccount.blocked['slow'].set()
+        thread.join()
+    assert FakeAccount.connects == ['fast', 'slow']
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for the processes plugin totals
+"""
+import pytest
+from collections import deque
+from pkm.plugins import processes
+
+
+@pytest.fixture
+def plugin(pkmeter):
+    plugin = processes.Plugin(pkmeter)
+    plugin.procs, plugin.users, plugin.trees, plugin.usernames = {}, {}, {}, {}
+    plugin.sortkey, plugin.limits, plugin.budget, plugin.rotation = 'cpu_percent', {}, 10, deque()
+    return plugin
+
+
+def _add(plugin, pid, ppid, name, cpu_percent=1.0, memory_rss=100):
+    proc = {'pid':pid, 'ppid':ppid, 'name':name, 'username':'pk', 'cpu_percent':0.0, 'memory_rss':0, 'tree':pid}
+    plugin._join_totals(proc, 1)
+    plugin.procs[pid] = proc
+    plugin._add_to_totals(proc, cpu_percent, memory_rss)
+    proc['cpu_percent'], proc['memory_rss'] = cpu_percent, memory_rss
+
+
+def _trees(plugin):
+    return {pid:(tree['name'], tree['count'], tree['memory_rss']) for pid, tree in plugin.trees.items()}
+
+
+def test_trees_group_by_top_ancestor(plugin):
+    # Pids are not in parent order; 150 is a child of 300
+    for pid, ppid, name in ((1, 0, 'systemd'), (150, 300, 'python'), (100, 1, 'sshd'),
+            (200, 100, 'bash'), (300, 200, 'vim'), (500, 1, 'cron')):
+        _add(plugin, pid, ppid, name)
+    plugin._update_trees()
+    assert _trees(plugin) == {1:('systemd', 1, 100), 100:('sshd', 4, 400), 500:('cron', 1, 100)}
+    assert plugin.trees[100]['cpu_percent'] == 4.0
+    assert plugin.procs[150]['tree'] == 100
+
+
+def test_trees_follow_reparenting(plugin):
+    for pid, ppid, name in ((100, 1, 'sshd'), (200, 100, 'bash'), (300, 200, 'vim'), (301, 300, 'sh')):
+        _add(plugin, pid, ppid, name)
+    plugin._update_trees()
+    plugin.procs[300]['ppid'] = 1
+    plugin._remove_proc(200)
+    plugin._update_trees()
+    assert _trees(plugin) == {100:('sshd', 1, 100), 300:('vim', 2, 200)}
+
+
+def test_trees_survive_ppid_cycles(plugin):
+    _add(plugin, 400, 401, 'a')
+    _add(plugin, 401, 400, 'b')
+    _add(plugin, 402, 401, 'c')
+    plugin._update_trees()
+    assert sum(tree['count'] for tree in plugin.trees.values()) == 3
+    assert len(set(proc['tree'] for proc in plugin.procs.values())) == 1
+
+
+def test_update_totals_match_processes(plugin):
+    plugin.update()
+    plugin.update()
+    assert plugin.data['total'] == len(plugin.procs) > 0
+    assert sum(tree['count'] for tree in plugin.trees.values()) == len(plugin.procs)
+    assert sum(user['count'] for user in plugin.users.values()) == len(plugin.procs)
+    assert sum(tree['memory_rss'] for tree in plugin.trees.values()) == \
+        sum(proc['memory_rss'] for proc in plugin.procs.values())
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for template variables and window filters
+"""
+import pytest
+from pkm import windows
+from pkm.exceptions import ParseError
+from pkm.template import Template, Variable
+
+
+def test_variable_filters():
+    variable = Variable('system.name|lower')
+    assert variable.get_value({'system':{'name':'PKMeter'}}) == 'pkmeter'
+
+
+def test_window_filter():
+    variable = Variable('tests.value|avg:"60s"')
+    for i, value in enumerate((10, 20, 40)):
+        windows.update_windows('tests', {'tests':{'value':value}}, now=1000 + i)
+    assert variable.get_value({'tests':{'value':40}}) == pytest.approx(70 / 3)
+
+
+def test_window_filter_must_come_first():
+    with pytest.raises(ParseError):
+        Variable('tests.value|invert|avg:"60s"')
+
+
+def test_window_filter_on_iter_rows():
+    with pytest.raises(ParseError):
+        Template('{{this.value|max:"5m"}}', lambda value: None)
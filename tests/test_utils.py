@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for pkm.utils
+"""
+from pkm import utils
+
+
+def test_ignore_substrings_are_case_insensitive():
+    matcher = utils.ignore_matcher('Kids\nnews')
+    assert matcher('The Kids Show')
+    assert matcher('Evening NEWS')
+    assert not matcher('Documentary')
+    assert not matcher('')
+
+
+def test_ignore_punctuation_is_plain_text():
+    # Entries with glob or regex characters still match as substrings
+    matcher = utils.ignore_matcher('What If...?\n[Draft]\nStar*')
+    assert matcher("Marvel's What If...? s01e01")
+    assert matcher('Album [draft] 2010')
+    assert matcher('My Star* Photos')
+    assert not matcher('What If')
+    assert not matcher('Starship')
+
+
+def test_ignore_globs_need_prefix():
+    matcher = utils.ignore_matcher('glob:2010*Party')
+    assert matcher('2010 Birthday Party')
+    assert not matcher('Pics 2010 Party')
+
+
+def test_ignore_regexes():
+    matcher = utils.ignore_matcher('re:^s\\d+e\\d+$\nre:(?i:FOO)bar')
+    assert matcher('s01e02')
+    assert matcher('fooBAR')
+    assert not matcher('xs01e02')
+
+
+def test_ignore_skips_empty_and_invalid_entries():
+    assert not utils.ignore_matcher('\n  \nre:\nglob:')('anything')
+    matcher = utils.ignore_matcher('re:(?i)foo\nre:(\nbar')
+    assert matcher('BAR')
+    assert not matcher('foo')